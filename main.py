@@ -2,14 +2,23 @@ import openai
 import os
 from time import sleep
 from processing.generate_response import generate_response
+from utils.grammar import get_grammar_checker
 from dotenv import load_dotenv
 
 def main():
     
     load_dotenv()
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', 8))
+    PRESELECT_RATIO = float(os.getenv('PRESELECT_RATIO', 0.1))
+    HTML_PARSER = os.getenv('HTML_PARSER', 'html.parser')
+    MAX_PAGES = int(os.getenv('MAX_PAGES', 3))
+    MAX_DEPTH = int(os.getenv('MAX_DEPTH', 2))
+    MAX_FETCHES = int(os.getenv('MAX_FETCHES', 3))
 
     openai.api_key = OPENAI_API_KEY
+    # LanguageTool takes seconds to start, start it while the user types the question
+    get_grammar_checker().warm_up()
     
     print("\nISAAC: Hello I am ISAAC, your AI assistant, ask me anything :)")
     print("If you want to quit this conversation, you can simply type QUIT() or EXIT()")
@@ -19,8 +28,19 @@ def main():
         user_input = input('\nUSER: ')
         if user_input == 'QUIT()' or user_input == 'EXIT()':
             return
-        output = generate_response(user_input)
-        print('\n\nISAAC: %s' % output)
+        # the final answer is printed as it is generated, if it is generated by GPT-4
+        streamed = []
+        def print_delta(delta: str) -> None:
+            if not streamed:
+                print('\n\nISAAC: ', end='')
+            streamed.append(delta)
+            print(delta, end='', flush=True)
+        output = generate_response(user_input, max_in_flight=MAX_IN_FLIGHT, preselect_ratio=PRESELECT_RATIO, html_parser=HTML_PARSER, on_delta=print_delta,
+                                     max_pages=MAX_PAGES, max_depth=MAX_DEPTH, max_fetches=MAX_FETCHES)
+        if streamed:
+            print()
+        else:
+            print('\n\nISAAC: %s' % output)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
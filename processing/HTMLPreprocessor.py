@@ -1,32 +1,85 @@
 import logging
-from typing import List, Dict, Optional
+import hashlib
+import os
+import pickle
+import threading
+import zlib
+from typing import Callable, List, Dict, Iterator, Optional, Tuple
 from bs4 import BeautifulSoup
 from html2text import html2text
 import copy
-from utils.split_text import split_text_by_char_len
-from utils.process_md import remove_links, remove_multi_line_breaks, format_md
+from utils.split_text import split_text_by_char_len, split_text_by_length, pack_pieces
+from utils.tokens import chunk_token_budget, token_counter
+from utils.process_md import clean_md
+from utils.dedup import remove_contained
 from utils.gpt import gpt4_chat
+from utils.parallel import parallel_map
+from utils.cache import SQLiteCache
+from processing import lxml_cleaner
 
 logger = logging.getLogger(__name__)
 
+# bump this whenever the output of preprocessing or splitting changes, so old cached results are not used
+PREPROCESSOR_VERSION = 4
+
+_preprocess_cache: Optional[SQLiteCache] = None
+_preprocess_cache_configured = False
+_preprocess_cache_lock = threading.Lock()
+
+
+def get_preprocess_cache() -> Optional[SQLiteCache]:
+    """
+    The process-wide cache of preprocessed webpages, configured from the environment on first use, None if disabled.
+    PREPROCESS_CACHE ("on" or "off", default "on"), PREPROCESS_CACHE_FILE (default "preprocess_cache/documents.sqlite3"),
+    PREPROCESS_CACHE_MAX_SIZE_MB (default 256), PREPROCESS_CACHE_MAX_AGE_DAYS (default 30)
+    """
+    global _preprocess_cache, _preprocess_cache_configured
+    with _preprocess_cache_lock:
+        if not _preprocess_cache_configured:
+            if os.getenv("PREPROCESS_CACHE", "on").lower() != "off":
+                _preprocess_cache = SQLiteCache(
+                    os.getenv("PREPROCESS_CACHE_FILE", os.path.join("preprocess_cache", "documents.sqlite3")),
+                    max_size=int(float(os.getenv("PREPROCESS_CACHE_MAX_SIZE_MB", 256)) * 1024 * 1024),
+                    max_age=float(os.getenv("PREPROCESS_CACHE_MAX_AGE_DAYS", 30)) * 24 * 3600,
+                )
+            _preprocess_cache_configured = True
+        return _preprocess_cache
+
+
 def _html2md(soup: BeautifulSoup) -> str:
     simple_tree = soup.prettify() 
     markdown = html2text(str(simple_tree))
-    markdown = remove_links(markdown)
-    markdown = format_md(markdown)
-    markdown = remove_multi_line_breaks(markdown)
-    return markdown
+    return clean_md(markdown)
 
 
-def _have_at_least_one_same_class(classes1: List, classes2: List) -> bool:
+def _have_at_least_one_same_class(classes1: frozenset, classes2: frozenset) -> bool:
     if classes1 == classes2:
         return True
-    for class1 in classes1:
-        for class2 in classes2:
-            if class1 == class2:
-                return True
-    return False
+    return not classes1.isdisjoint(classes2)
+
 
+# modulus and base of the rolling hash of the structure of subtrees
+_HASH_MOD = (1 << 61) - 1
+_HASH_BASE = 1000003
+
+
+def _group_by_length(texts: List[str], window_size: int, separator: str="", length: Callable[[str], int]=len) -> List[List[str]]:
+    """
+    Group consecutive texts so that each group joined by the separator is at most window_size (measured by length,
+    characters by default), a text longer than window_size would be in a group by itself
+    """
+    groups: List[List[str]] = []
+    group_len = 0
+    separator_len = length(separator)
+    for text in texts:
+        text_len = length(text)
+        if groups and group_len + separator_len + text_len <= window_size:
+            groups[-1].append(text)
+            group_len += separator_len + text_len
+        else:
+            groups.append([text])
+            group_len = text_len
+    return groups
 
 
 class HTMLPreprocessor:
@@ -39,8 +92,26 @@ class HTMLPreprocessor:
     def __init__(
         self,
         html: str,
-        base_url: Optional[str]=None
+        base_url: Optional[str]=None,
+        use_cache: bool=True,
+        parser: str="html.parser"
     ):
+        """
+        Parameters:
+        html (str): HTML source of the webpage
+        base_url (str or None): URL of the webpage, used to complete relative hyperlinks
+        use_cache (bool): reuse the results of an earlier run on the same HTML from the process-wide preprocess cache,
+            the HTML is then only parsed if a split that is not cached is needed
+        parser (str): "html.parser" or "lxml". With "lxml" the HTML is parsed and cleaned by lxml, which is a lot faster
+            and uses less memory, then only the cleaned body is given to BeautifulSoup. "html.parser" is the reference.
+            On well-nested pages both give the same results (see tests/test_parser_parity.py), but they recover
+            differently from broken markup, so the markdown and the lists can differ there: lxml closes a <p> before
+            a <table> inside it (e.g. <p>pre<table>...</table>post</p> gives "pre" in its own paragraph), and lxml
+            drops a stray end tag without the space html.parser puts in its place (<div>a</span>b</div> gives "ab").
+        """
+        if parser not in ("html.parser", "lxml"):
+            raise ValueError(f'parser should be "html.parser" or "lxml", got "{parser}"')
+        self.parser = parser
         self.soup: BeautifulSoup = None
         self.html_source: str = html
         self.base_url = base_url
@@ -51,6 +122,19 @@ class HTMLPreprocessor:
         self.sidebars: List[Dict[str, str]] = []
         self.hyperlinks: List[str] = []
         self.lists: List[BeautifulSoup] = []
+        self._markdown_cache: Dict[int, Tuple[BeautifulSoup, str]] = {}
+        # built by _index_tree: element children, classes and structure signature of every element, by id
+        self._children: Dict[int, List[BeautifulSoup]] = {}
+        self._class_keys: Dict[int, frozenset] = {}
+        self._signatures: Dict[int, Tuple[int, int]] = {}
+        self._tag_ids: Dict[str, int] = {}
+        # by (window size, stride, model) and (window size, model), model None for sizes in characters
+        self._splits: Dict[Tuple[int, int, Optional[str]], List[str]] = {}
+        self._lists_splits: Dict[Tuple[int, Optional[str]], List[str]] = {}
+        self.cache = get_preprocess_cache() if use_cache else None
+        self.cache_key = hashlib.sha256(
+            f"{PREPROCESSOR_VERSION}\n{parser}\n{base_url}\n{html}".encode("utf-8", errors="surrogatepass")
+        ).hexdigest()
         self.loaded = False
         self.preprocess()
     
@@ -59,10 +143,41 @@ class HTMLPreprocessor:
         """
         Called when the instance created, preprocess the HTML to everything we need
         """
-        self.soup = BeautifulSoup(
-            "".join(s.strip() for s in self.html_source.split("\n")),
-            "html.parser",
-        )
+        if self._load_cache():
+            self.loaded = True
+            return
+        self.parse()
+        self._save_cache()
+
+
+    def parse(self) -> None:
+        """
+        Parse and clean the HTML, find the lists and convert the page to markdown
+        """
+        self._markdown_cache = {}
+        self._children = {}
+        self._class_keys = {}
+        self._signatures = {}
+        self._tag_ids = {}
+        self.header = {"source": "", "markdown": ""}
+        self.footer = {"source": "", "markdown": ""}
+        self.sidebars = []
+        self.hyperlinks = []
+        self.lists = []
+        html = "".join(s.strip() for s in self.html_source.split("\n"))
+        if self.parser == "lxml":
+            self._parse_lxml(html)
+        else:
+            self._parse_html_parser(html)
+        self.get_lists(5) # get all the "lists" (elements with similar structure)
+
+        self.complete_markdown = self._markdown(self.soup.body)
+
+        self.loaded = True
+
+
+    def _parse_html_parser(self, html: str) -> None:
+        self.soup = BeautifulSoup(html, "html.parser")
 
         # remove scripts and styles
         for s in self.soup.select("script"):
@@ -78,97 +193,237 @@ class HTMLPreprocessor:
         if head:
             head.extract()
 
-        self.find_hyperlinks()
-        self.extract_hidden() # remove all the hidden elements if has style property or hidden property
-        self.extract_header_footer() # remove headers and footers
-        self.extract_sidebar() # remove sidebar (if can)
-        self.get_lists(5) # get all the "lists" (elements with similar structure)
+        # one pass: collect hyperlinks, remove hidden elements, find header, footer and sidebars, index the tree for get_lists
+        found = {"links": [], "header": [[], [], []], "footer": [[], [], []], "sidebars": []}
+        self._index_tree(self.soup, body=self.soup.body, found=found)
+        if self.base_url:
+            self.hyperlinks = self._format_hyperlinks(found["links"])
+        self.extract_header_footer(found["header"], found["footer"]) # remove headers and footers
+        self.extract_sidebars(found["sidebars"]) # remove sidebar (if can)
+
+
+    def _parse_lxml(self, html: str) -> None:
+        cleaned = lxml_cleaner.clean_html(html, find_links=bool(self.base_url))
+        self.title = cleaned["title"]
+        if self.base_url:
+            self.hyperlinks = self._format_hyperlinks(cleaned["links"])
+        if cleaned["header"] is not None:
+            self.header = {"source": cleaned["header"], "markdown": _html2md(BeautifulSoup(cleaned["header"], "html.parser"))}
+        if cleaned["footer"] is not None:
+            self.footer = {"source": cleaned["footer"], "markdown": _html2md(BeautifulSoup(cleaned["footer"], "html.parser"))}
+        for source in cleaned["sidebars"]:
+            self.sidebars.append({"source": source, "markdown": _html2md(BeautifulSoup(source, "html.parser"))})
+        self.soup = BeautifulSoup(cleaned["body"], "lxml")
+        self._index_tree(self.soup)
+
+
+    def _load_cache(self) -> bool:
+        """
+        Restore the results of an earlier run on the same HTML, without parsing it.
+        soup and lists are BeautifulSoup objects and are not cached, they are only set after parse()
+
+        Returns:
+        bool: whether the results were in the cache
+        """
+        if self.cache is None:
+            return False
+        value = self.cache.get(self.cache_key)
+        if value is None:
+            return False
+        try:
+            state = pickle.loads(zlib.decompress(value))
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Error reading cached preprocessing results: %s", err)
+            return False
+        self.title = state["title"]
+        self.hyperlinks = state["hyperlinks"]
+        self.complete_markdown = state["complete_markdown"]
+        self.header = state["header"]
+        self.footer = state["footer"]
+        self.sidebars = state["sidebars"]
+        self._splits = state["splits"]
+        self._lists_splits = state["lists_splits"]
+        return True
 
-        self.complete_markdown = _html2md(self.soup.body)
 
-        self.loaded = True
+    def _save_cache(self) -> None:
+        if self.cache is None:
+            return
+        state = {
+            "title": self.title,
+            "hyperlinks": self.hyperlinks,
+            "complete_markdown": self.complete_markdown,
+            "header": self.header,
+            "footer": self.footer,
+            "sidebars": self.sidebars,
+            "splits": self._splits,
+            "lists_splits": self._lists_splits,
+        }
+        self.cache.set(self.cache_key, zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)))
+
+
+    def _ensure_parsed(self) -> None:
+        # restored from the cache, but something not cached is needed
+        if self.soup is None:
+            self.parse()
+
+
+    def _markdown(self, node: BeautifulSoup) -> str:
+        """
+        Markdown of a node, each node is only converted once per preprocessing run and then reused
+        by the splits, the header/footer/sidebar extraction and the complete markdown.
+        A node is only converted after all the elements that will be removed from it are removed.
+        """
+        entry = self._markdown_cache.get(id(node))
+        # the node is kept in the entry, so its id can't be reused by another node
+        if entry is None or entry[0] is not node:
+            entry = (node, _html2md(node))
+            self._markdown_cache[id(node)] = entry
+        return entry[1]
 
 
-    def find_hyperlinks(self) -> list[str]:
+    def _format_hyperlinks(self, links: list[tuple[str, str]]) -> list[str]:
         """
-        Find all the hyperlinks on this page, result will be both returned and stored in self.hyperlinks
+        Format (text, href) of links as "text (url)", relative URLs are completed with base_url
+        and links that are neither absolute nor relative to the root are skipped
         """
-        if not self.base_url:
-            return
-        links = self.soup.find_all('a', href=True)
         link_tuples = []
-        for link in links:
-            if link["href"].startswith("http"):
-                link_tuples.append((link.text, link["href"]))
-            elif not link["href"].startswith("/"):
+        for link_text, href in links:
+            if href.startswith("http"):
+                link_tuples.append((link_text, href))
+            elif not href.startswith("/"):
                 continue
             else:
-                link_tuples.append((link.text, self.base_url + link["href"][1:]))
-
-        def format_hyperlinks(link_tuples: list[tuple[str, str]]) -> list[str]:
-            return [f"{link_text} ({link_url})" for link_text, link_url in link_tuples]
-        
-        self.hyperlinks = format_hyperlinks(link_tuples)
-        return self.hyperlinks
+                link_tuples.append((link_text, self.base_url + href[1:]))
+        return [f"{link_text} ({link_url})" for link_text, link_url in link_tuples]
     
 
-    def extract_header_footer(self) -> None:
+    def extract_header_footer(self, headers: List[List[BeautifulSoup]], footers: List[List[BeautifulSoup]]) -> None:
         """
         Try to find header and footer, store them and remove them in the markdown doc
+
+        Parameters:
+        headers, footers (List[List[BeautifulSoup]]): found by _index_tree, the <header> (<footer>) elements, the elements
+            with class "header" ("footer") and the elements with id "header" ("footer"), each in document order
         """
-        header = self.soup.find('header')
-        if not header:
-            header = self.soup.find(class_='header')
-            if not header:
-                header = self.soup.find(id='header')
+        # the first <header>, else the first with the class, else the first with the id
+        header = next((node for candidates in headers for node in candidates if self._in_tree(node)), None)
         if header:
             self.header["source"] = str(header)         
-            self.header["markdown"] = _html2md(header)
-            header.extract()
-        footer = self.soup.find('footer')
-        if not footer:
-            footer = self.soup.find(class_='footer')
-            if not footer:
-                footer = self.soup.find(id='footer')
+            self.header["markdown"] = self._markdown(header)
+            self._detach(header)
+        # a footer in the header is already removed
+        footer = next((node for candidates in footers for node in candidates if self._in_tree(node)), None)
         if footer:
             self.footer["source"] = str(footer)
-            self.footer["markdown"] = _html2md(footer)
-            footer.extract()
+            self.footer["markdown"] = self._markdown(footer)
+            self._detach(footer)
     
 
-    def extract_sidebar(self) -> None:
+    def extract_sidebars(self, sidebars: List[BeautifulSoup]) -> None:
         """
-        Try to remove sidebar on the page, often not work
+        Store and remove the sidebars found by _index_tree, sidebars removed with the header or footer are skipped.
+        Often not work
+
+        Parameters:
+        sidebars (List[BeautifulSoup]): outermost elements with class or id "sidebar" in the body, in document order
         """
-        def extract_sidebar_helper(node):
-            if (node.has_attr('class') and 'sidebar' in node['class']) or (node.has_attr('id') and 'sidebar' == node['id']): 
-                md = _html2md(node)
-                self.sidebars.append({"source": str(node), "markdown": md})
-                node.extract()
-                return
-            for child in node.find_all(recursive=False):
-                extract_sidebar_helper(child)
-        extract_sidebar_helper(self.soup.body)
+        for node in sidebars:
+            if not self._in_tree(node):
+                continue
+            md = self._markdown(node)
+            self.sidebars.append({"source": str(node), "markdown": md})
+            self._detach(node)
 
 
-    def extract_hidden(self) -> None:
+    def _in_tree(self, node: BeautifulSoup) -> bool:
+        return any(parent is self.soup for parent in node.parents)
+
+
+    def _index_tree(
+        self,
+        node: BeautifulSoup,
+        body: Optional[BeautifulSoup]=None,
+        found: Optional[Dict[str, list]]=None,
+        in_body: bool=False,
+        in_sidebar: bool=False
+    ) -> bool:
         """
-        Remove all the invisible elements on the page
+        The single traversal of the tree in document order. For every element, its element children, its classes and
+        a signature of its structure are stored for get_lists: a rolling hash and the length of the names of all the
+        tags in its subtree in document order, so two elements have the same structure iff they have the same
+        signature (up to hash collisions). If body is given, the page is also cleaned on the way, and what is found
+        is added to the lists in found:
+        - "links": the text and href of every <a> with a href
+        - invisible elements in the body (style "display: none", or "visibility" and the hidden property) are removed
+        - "header" and "footer": visible candidates for extract_header_footer
+        - "sidebars": the outermost visible elements in the body with class or id "sidebar"
+
+        Returns:
+        bool: whether node is still in the tree
         """
-        def extract_hidden_helper(node):
-            if isinstance(node, str) or len(node.find_all(recursive=False)) == 0:
-                return
-            if node.hidden:
+        children = node.find_all(recursive=False)
+        if body is not None:
+            if node.name == 'a' and node.has_attr('href'):
+                found["links"].append((node.text, node['href']))
+            in_body = in_body or node is body
+            if in_body and len(children) > 0 and self._is_hidden(node):
+                # hyperlinks are collected from the whole page, including the invisible elements
+                found["links"].extend((link.text, link['href']) for link in node.find_all('a', href=True))
                 node.extract()
-                return
-            style = node.get('style')
-            if style:
-                if ('display' in style and 'none' in style) or ('visibility' in style and node.has_attr('hidden')):
-                    node.extract()
-                    return
-            for child in node.find_all(recursive=False):
-                extract_hidden_helper(child)
-        extract_hidden_helper(self.soup.body)
+                return False
+            classes = node['class'] if node.has_attr('class') else []
+            node_id = node.get('id')
+            for region in ("header", "footer"):
+                if node.name == region:
+                    found[region][0].append(node)
+                if region in classes:
+                    found[region][1].append(node)
+                if node_id == region:
+                    found[region][2].append(node)
+            if in_body and not in_sidebar and ('sidebar' in classes or 'sidebar' == node_id):
+                found["sidebars"].append(node)
+                in_sidebar = True
+        children = [
+            child for child in children
+            if self._index_tree(child, body, found, in_body, in_sidebar)
+        ]
+        self._children[id(node)] = children
+        self._class_keys[id(node)] = frozenset(node['class'] if node.has_attr('class') else [])
+        self._signatures[id(node)] = self._signature(children)
+        return True
+
+
+    @staticmethod
+    def _is_hidden(node: BeautifulSoup) -> bool:
+        if node.hidden:
+            return True
+        style = node.get('style')
+        return bool(style) and (('display' in style and 'none' in style) or ('visibility' in style and node.has_attr('hidden')))
+
+
+    def _signature(self, children: List[BeautifulSoup]) -> Tuple[int, int]:
+        sig_hash, sig_len = 0, 0
+        for child in children:
+            child_hash, child_len = self._signatures[id(child)]
+            tag_id = self._tag_ids.setdefault(child.name, len(self._tag_ids) + 1)
+            # hash of the sequence: previous tags, then this child's name, then the child's subtree
+            sig_hash = ((sig_hash * _HASH_BASE + tag_id) * pow(_HASH_BASE, child_len, _HASH_MOD) + child_hash) % _HASH_MOD
+            sig_len += child_len + 1
+        return sig_hash, sig_len
+
+
+    def _detach(self, node: BeautifulSoup) -> None:
+        """
+        Remove node from the tree, and update the children and signatures of its ancestors stored by _index_tree
+        """
+        parent = node.parent
+        node.extract()
+        if parent is not None and id(parent) in self._children:
+            self._children[id(parent)] = [child for child in self._children[id(parent)] if child is not node]
+        while parent is not None and id(parent) in self._children:
+            self._signatures[id(parent)] = self._signature(self._children[id(parent)])
+            parent = parent.parent
 
 
     def get_lists(self, threshold=5) -> None:
@@ -178,9 +433,17 @@ class HTMLPreprocessor:
         Parameters:
         threshold: minimum number of elements a list need to have.
         """
+        # the element children, classes and structure signatures come from _index_tree,
+        # two children have the same structure iff they have the same signature, so comparing two subtrees is O(1)
+        element_children = self._children
+        class_keys = self._class_keys
+        signatures = self._signatures
+
+        is_leaf = lambda node: len(element_children[id(node)]) == 0
+
         # this helper function is for pre-order traversal
         def get_lists_helper(node: BeautifulSoup, threshold: int) -> None:
-            if isinstance(node, str) or len(node.find_all(recursive=False)) == 0:
+            if isinstance(node, str) or is_leaf(node):
                 return
 
             # remove all the line breaks
@@ -189,7 +452,7 @@ class HTMLPreprocessor:
                     child.decompose()
 
             # do pre-order traversal
-            for child in node.find_all(recursive=False):
+            for child in element_children[id(node)]:
                 get_lists_helper(  # pylint: disable=cell-var-from-loop
                     child, threshold
                 )
@@ -198,17 +461,17 @@ class HTMLPreprocessor:
             subtree = None
             max_len_children_same_structure = 1
             curr_len_children_same_structure = 1
-            for child in node.find_all(recursive=False):
-                subtree_rooted_at_child = [tag.name for tag in child.find_all(recursive=True)]
+            for child in element_children[id(node)]:
+                subtree_rooted_at_child = signatures[id(child)]
                 if subtree is None:
                     subtree = subtree_rooted_at_child
                 else:
-                    if (subtree == subtree_rooted_at_child) and not (isinstance(child, str) or len(child.find_all(recursive=False)) == 0):
+                    if (subtree == subtree_rooted_at_child) and not is_leaf(child):
                         curr_len_children_same_structure += 1
                     else:
                         if curr_len_children_same_structure > max_len_children_same_structure:
                             max_len_children_same_structure = curr_len_children_same_structure
-                        subtree = subtree_rooted_at_child if not (isinstance(child, str) or len(child.find_all(recursive=False)) == 0) else None
+                        subtree = subtree_rooted_at_child if not is_leaf(child) else None
                         curr_len_children_same_structure = 1
             
             if curr_len_children_same_structure > max_len_children_same_structure:
@@ -219,20 +482,20 @@ class HTMLPreprocessor:
             max_len_children_same_tag_class = 1
             curr_len_children_same_tag_class = 1
             tag: str = None
-            class_: List[str] = None
-            for child in node.find_all(recursive=False):
+            class_: frozenset = None
+            for child in element_children[id(node)]:
                 if tag is None or class_ is None:
                     if tag is None:
                         tag = child.name
                     if class_ is None:
-                        class_ = child['class'] if child.has_attr('class') else []
-                elif _have_at_least_one_same_class(child['class'] if child.has_attr('class') else [], class_) and child.name == tag and not (isinstance(child, str) or len(child.find_all(recursive=False)) == 0):
+                        class_ = class_keys[id(child)]
+                elif _have_at_least_one_same_class(class_keys[id(child)], class_) and child.name == tag and not is_leaf(child):
                     curr_len_children_same_tag_class += 1
                 else:
                     if (curr_len_children_same_tag_class > max_len_children_same_tag_class):
                         max_len_children_same_tag_class = curr_len_children_same_tag_class
-                    tag = child.name if not (isinstance(child, str) or len(child.find_all(recursive=False)) == 0) else None
-                    class_ = (child['class'] if child.has_attr('class') else []) if not (isinstance(child, str) or len(child.find_all(recursive=False)) == 0) else None
+                    tag = child.name if not is_leaf(child) else None
+                    class_ = class_keys[id(child)] if not is_leaf(child) else None
                     curr_len_children_same_tag_class = 1
             
             if curr_len_children_same_tag_class > max_len_children_same_tag_class:
@@ -246,7 +509,7 @@ class HTMLPreprocessor:
             components = list()
             components_same_tag = True
             
-            for child in node.find_all(recursive=False):
+            for child in element_children[id(node)]:
                 if first_node is None:
                     component.append(child)
                     first_node = child
@@ -308,52 +571,57 @@ class HTMLPreprocessor:
             
         get_lists_helper(self.soup.body, threshold)
 
-    def build_lists_split(self, window_size: int=6000) -> List[str]:
+    def build_lists_split(self, window_size: int=6000, model: Optional[str]=None) -> List[str]:
         """
         Create split of lists, each two element would be separated by a  "______"
 
         Parameters:
-        window_size (int): the length of each chunk of split in number of characters
+        window_size (int): the length of each chunk of split in number of characters, or in tokens if model is given
+        model (str or None): the model the chunks are sent to, to measure the chunks in its tokens
         
         Returns:
         List[str]: the split
         """
         if not self.loaded:
             raise Exception('please use the load() function before building split of lists')
+        if (window_size, model) in self._lists_splits:
+            return self._lists_splits[(window_size, model)][:]
+        self._ensure_parsed()
+        length = token_counter(model)
+        separator_len = length("\n______\n")
+        # in tokens the window is a hard limit of the prompt, so the separators count as well; in characters the
+        # chunks stay as they always were, separators not counted
+        fit_separator_len = separator_len if model is not None else 0
         split: List[str] = []
         tmp = ""
+        tmp_len = 0
         for list in self.lists:
             for child in list.children:
-                text = _html2md(child)
-                if len(text) > window_size:
+                text = self._markdown(child)
+                text_len = length(text)
+                if text_len > window_size:
                     break
-                if len(tmp + text) > window_size:
+                if tmp_len + (fit_separator_len if tmp else 0) + text_len > window_size:
                     split.append(tmp)
                     tmp = text
+                    tmp_len = text_len
                 else:
                     if tmp == "":
                         tmp = text
+                        tmp_len = text_len
                     else:
                         tmp += "\n______\n" + text
+                        tmp_len += separator_len + text_len
             if len(tmp) > 0:
                 split.append(tmp)
-        # there might be duplicates, remove all the duplicates
-        i = 0
-        while i < len(split):
-            j = 0
-            while j < len(split):
-                if j != i:
-                    # if one element is in another element, remove it
-                    if split[i] in split[j]:
-                        split.pop(i)
-                        i -= 1
-                        break
-                j += 1
-            i += 1
-        return split
+        # there might be duplicates, remove all the duplicates and elements contained in another element
+        split = remove_contained(split)
+        self._lists_splits[(window_size, model)] = split
+        self._save_cache()
+        return split[:]
     
-    # window size here is number of characters
-    def build_split(self, window_size: int=6000, stride: int=6000) -> List[str]:
+    # window size here is number of characters, or number of tokens if a model is given
+    def build_split(self, window_size: int=6000, stride: int=6000, model: Optional[str]=None) -> List[str]:
         """
         Split the webpage based on number of characters. See more information on the research report.
         You can also set the overlap by the "stride"
@@ -362,73 +630,108 @@ class HTMLPreprocessor:
         Parameters:
         window_size (int): the length of each chunk of split in number of characters
         stride (int or None): e.g. if stride=3000, the distance between the starts of two chunks are 3000 characters.
+        model (str or None): the model the chunks are sent to, window_size and stride are then in its tokens,
+            so the chunks fill the prompt whatever the language or markup of the webpage
 
         Returns:
         List[str]: the split
         """
-        if len(self.complete_markdown) < window_size:
-            return [self.complete_markdown]
-        def build_split_helper(node, window_size) -> List[str]:
-            # base case
-            if len(node.find_all(recursive=False)) == 0:        
-                md = _html2md(node)
-                if len(md) > window_size:
-                    return split_text_by_char_len(md, window_size=window_size, stride=stride)
+        return list(self.iter_split(window_size=window_size, stride=stride, model=model))
+
+    def iter_split(self, window_size: int=6000, stride: int=6000, model: Optional[str]=None) -> Iterator[str]:
+        """
+        Same as build_split, but each chunk is yielded as soon as it is complete, so the chunks can be used
+        before the whole webpage is split.
+        """
+        key = (window_size, stride, model)
+        if key in self._splits:
+            yield from self._splits[key]
+            return
+        split = []
+        for chunk in self._iter_split(window_size, stride, model):
+            split.append(chunk)
+            yield chunk
+        self._splits[key] = split
+        self._save_cache()
+
+    def _iter_split(self, window_size: int, stride: int, model: Optional[str]) -> Iterator[str]:
+        length = token_counter(model)
+        if length(self.complete_markdown) < window_size:
+            yield self.complete_markdown
+            return
+        self._ensure_parsed()
+        def build_split_helper(node) -> Iterator[Tuple[str, int]]:
+            # a node short enough is one piece, else its children are split (or its text if it has no children)
+            md = self._markdown(node)
+            md_len = length(md)
+            if md_len <= window_size:
+                yield md, md_len
+            elif len(node.find_all(recursive=False)) == 0:
+                if model is None:
+                    texts = split_text_by_char_len(md, window_size=window_size, stride=stride)
                 else:
-                    return [md]
-            
-            split_list = list()
-            # do a post order traversal
-            for child in node.find_all(recursive=False):
-                split_list += build_split_helper(child, window_size)
-                    
-            md = _html2md(node)
-            if len(md) > window_size:
-                return split_list
-            else:
-                return [md]
-        split = build_split_helper(self.soup.body, window_size)
-
-        new_split: List[str] = [""]
-        can_add: List[bool] = [True]
-        stride_tmp = ""
-        for chunk in split:
-            for i in range(len(new_split)):
-                if can_add[i] and len(new_split[i] + chunk) > window_size:
-                    can_add[i] = False
-                if can_add[i] and len(new_split[i] + chunk) <= window_size:
-                    new_split[i] += chunk
-            if len(stride_tmp + chunk) <= stride:
-                stride_tmp += chunk
+                    texts = split_text_by_length(md, window_size=window_size, stride=stride, length=length)
+                for text in texts:
+                    yield text, length(text)
             else:
-                new_split.append(chunk)
-                can_add.append(True)
-                stride_tmp = chunk
-        
-        return new_split
-    
-    def summarize(self) -> str:
+                for child in node.find_all(recursive=False):
+                    yield from build_split_helper(child)
+
+        yield from pack_pieces(build_split_helper(self.soup.body), window_size, stride)
+
+    def summarize(self, window_size: Optional[int]=20000, max_in_flight: int=8, model: Optional[str]=None) -> str:
         """
-        Summarize the webpage in map-reduce style
+        Summarize the webpage in map-reduce style. All the parts are summarized in parallel, if summaries
+        of the parts are still too long to fit in one prompt, they are reduced level by level like a tree.
+
+        Parameters:
+        window_size (int or None): maximum number of characters of webpage content or summaries in one prompt,
+            in tokens if model is given. None (with a model) to fill the context of the model.
+        max_in_flight (int): maximum number of GPT-4 calls at the same time
+        model (str or None): the model the prompts are sent to, to measure the prompts in its tokens
         """
-        split = self.build_split(window_size=20000)
+        if window_size is None:
+            if model is None:
+                raise Exception('window_size can only be None if a model is given')
+            window_size = chunk_token_budget(
+                model,
+                f'Here are summaries of some consecutive parts of the webpage "{self.title}":\n\n',
+                'Provide a detailed summary of these parts of webpage.',
+            )
+        length = token_counter(model)
+        split = self.build_split(window_size=window_size, stride=min(6000, window_size), model=model)
         if len(split) == 1:
             system_msg = f'This is content of the webpage "{self.title}":\n\n{self.complete_markdown}'
             user_msg = 'Provide a detailed summary of this webpage.'
             return gpt4_chat(system_msg, user_msg)
-        else:
-            part_summaries = []
-            for chunk in split:
-                system_msg = f'This is part of content of the webpage "{self.title}":\n\n{chunk}'
-                user_msg = 'Provide a detailed summary of this part of webpage.'
-                part_summary = gpt4_chat(system_msg, user_msg)
-                part_summaries.append(part_summary)
-            summaries_str = "\n______\n".join(part_summaries)
-            system_msg = f'Here are summaries of each part of the webpage "{self.title}":\n\n{summaries_str}'
-            user_msg = 'Provide a detailed summary of the entire webpage.'
+
+        # map: summarize each part of the webpage
+        def summarize_part(chunk: str) -> str:
+            system_msg = f'This is part of content of the webpage "{self.title}":\n\n{chunk}'
+            user_msg = 'Provide a detailed summary of this part of webpage.'
             return gpt4_chat(system_msg, user_msg)
-         
-    
+        summaries = parallel_map(summarize_part, split, max_workers=max_in_flight)
+
+        # reduce: while summaries are too long for one prompt, summarize groups of consecutive summaries
+        def summarize_group(group: List[str]) -> str:
+            if len(group) == 1:
+                return group[0]
+            summaries_str = "\n______\n".join(group)
+            system_msg = f'Here are summaries of some consecutive parts of the webpage "{self.title}":\n\n{summaries_str}'
+            user_msg = 'Provide a detailed summary of these parts of webpage.'
+            return gpt4_chat(system_msg, user_msg)
+        while length("\n______\n".join(summaries)) > window_size:
+            groups = _group_by_length(summaries, window_size, separator="\n______\n", length=length)
+            if len(groups) == len(summaries):
+                # no two summaries fit in one prompt, reducing further would not make progress
+                break
+            summaries = parallel_map(summarize_group, groups, max_workers=max_in_flight)
+
+        summaries_str = "\n______\n".join(summaries)
+        system_msg = f'Here are summaries of each part of the webpage "{self.title}":\n\n{summaries_str}'
+        user_msg = 'Provide a detailed summary of the entire webpage.'
+        return gpt4_chat(system_msg, user_msg)
+
     def save_source(self, file_path) -> None:
         """
         Save HTML source code
@@ -1,13 +1,39 @@
 import os
+import asyncio
 import logging
 from typing import List, Optional
 from langchain.docstore.document import Document
 from langchain.document_loaders.base import BaseLoader
-from playwright.sync_api import sync_playwright
+from urllib.parse import urlparse
+from playwright.sync_api import Page, Route, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import Page as AsyncPage, Route as AsyncRoute, TimeoutError as AsyncPlaywrightTimeoutError
+from processing.browser_pool import get_browser_pool, AsyncBrowserPool
+from processing.http_fetch import fetch_html_http, get_domain_mode
+from processing.page_cache import PageCache, get_page_cache
 
 os.environ["LANGCHAIN_HANDLER"] = "langchain"
 logger = logging.getLogger(__name__)
 
+# HTMLPreprocessor only keeps the text of the DOM, so by default nothing else is downloaded
+DEFAULT_BLOCKED_RESOURCE_TYPES = ["image", "media", "font", "stylesheet", "texttrack", "eventsource", "websocket", "manifest"]
+DEFAULT_BLOCKED_DOMAINS = [
+    "google-analytics.com", "googletagmanager.com", "googlesyndication.com", "doubleclick.net",
+    "googleadservices.com", "facebook.net", "connect.facebook.com", "hotjar.com", "segment.io",
+    "segment.com", "mixpanel.com", "newrelic.com", "nr-data.net", "optimizely.com", "scorecardresearch.com",
+    "quantserve.com", "adnxs.com", "criteo.com", "taboola.com", "outbrain.com", "amazon-adsystem.com",
+]
+
+# remove all the visible elements matching any of the selectors in one round trip
+REMOVE_SELECTORS_SCRIPT = """selectors => {
+    for (const selector of selectors) {
+        for (const element of document.querySelectorAll(selector)) {
+            if (element.getClientRects().length > 0 && window.getComputedStyle(element).visibility !== 'hidden') {
+                element.remove();
+            }
+        }
+    }
+}"""
+
 
 class URLLoader(BaseLoader):
     def __init__(
@@ -15,39 +41,195 @@ class URLLoader(BaseLoader):
         url: str = None,
         continue_on_failure: bool = True,
         headless: bool = True,
-        remove_selectors: Optional[List[str]] = None
+        remove_selectors: Optional[List[str]] = None,
+        block_resource_types: Optional[List[str]] = None,
+        block_domains: Optional[List[str]] = None,
+        wait_until: str = "domcontentloaded",
+        wait_for_selector: Optional[str] = None,
+        wait_timeout: float = 5000,
+        use_http: bool = True,
+        use_cache: bool = True
     ):
-        """Load a list of URLs using Playwright and unstructured."""
+        """
+        Load a list of URLs using Playwright and unstructured.
+
+        Parameters:
+        block_resource_types (List[str] or None): Playwright resource types not to download, default DEFAULT_BLOCKED_RESOURCE_TYPES
+        block_domains (List[str] or None): domains (and their subdomains) not to download from, default DEFAULT_BLOCKED_DOMAINS
+        wait_until (str): "domcontentloaded", "load" or "networkidle", what to wait for after the DOM is loaded
+        wait_for_selector (str or None): also wait until an element matching this selector is on the page
+        wait_timeout (float): maximum milliseconds to wait for wait_until and wait_for_selector, the page
+            is used as it is when the time is up
+        use_http (bool): try plain HTTP first, the browser is only used if the page seems to be rendered by JavaScript.
+            After the first fetch of a domain, the same way is used for the domain directly.
+        use_cache (bool): use the process-wide page cache, a fresh cached webpage is returned without any network request
+        """
         self.url = url
 
         self.continue_on_failure = continue_on_failure
         self.headless = headless
         self.remove_selectors = remove_selectors
+        self.block_resource_types = set(DEFAULT_BLOCKED_RESOURCE_TYPES if block_resource_types is None else block_resource_types)
+        self.block_domains = tuple(DEFAULT_BLOCKED_DOMAINS if block_domains is None else block_domains)
+        if wait_until not in ("domcontentloaded", "load", "networkidle"):
+            raise ValueError(f'wait_until should be "domcontentloaded", "load" or "networkidle", got "{wait_until}"')
+        self.wait_until = wait_until
+        self.wait_for_selector = wait_for_selector
+        self.wait_timeout = wait_timeout
+        self.use_http = use_http
+        self.page_cache: Optional[PageCache] = get_page_cache() if use_cache else None
 
         self.html = ""
 
-    def load(self) -> str:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=self.headless)                
-            try:
-                page = browser.new_page()
-                page.goto(self.url, wait_until="domcontentloaded")
-
-                for selector in self.remove_selectors or []:
-                    elements = page.locator(selector).all()
-                    for element in elements:
-                        if element.is_visible():
-                            element.evaluate("element => element.remove()")
-
-                self.html = page.content()
-            except Exception as err:  # pylint: disable=broad-except
-                if self.continue_on_failure:
-                    logger.error(
-                        "Error fetching or processing %s, exception: %s", self.url, err
-                    )
-                else:
-                    raise err
-            browser.close()
+    def _can_use_http(self) -> bool:
+        # removing elements and waiting for selectors need a browser
+        return (
+            self.use_http
+            and not self.remove_selectors
+            and not self.wait_for_selector
+            and get_domain_mode(self.url) != "browser"
+        )
+
+    def _load_cached(self) -> Optional[str]:
+        # elements to remove are removed in the browser, so those webpages are not cached
+        if self.page_cache is None or self.remove_selectors:
+            return None
+        cached = self.page_cache.get(self.url)
+        return cached["html"] if cached and cached["fresh"] else None
+
+    def _cache_browser_html(self) -> None:
+        if self.page_cache is not None and not self.remove_selectors and self.html:
+            self.page_cache.put(self.url, self.html)
+
+    def _load_http(self) -> Optional[str]:
+        try:
+            return fetch_html_http(self.url, page_cache=self.page_cache)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.info("Plain HTTP failed for %s, using the browser instead: %s", self.url, err)
+            return None
+
+    def _should_block(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.block_resource_types:
+            return True
+        host = urlparse(url).hostname or ""
+        return any(host == domain or host.endswith("." + domain) for domain in self.block_domains)
+
+    def _route(self, route: Route) -> None:
+        if self._should_block(route.request.resource_type, route.request.url):
+            route.abort()
+        else:
+            route.continue_()
+
+    async def _aroute(self, route: AsyncRoute) -> None:
+        if self._should_block(route.request.resource_type, route.request.url):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _load_page(self, page: Page) -> str:
+        if self.block_resource_types or self.block_domains:
+            page.route("**/*", self._route)
+        page.goto(self.url, wait_until="domcontentloaded")
+        try:
+            if self.wait_until != "domcontentloaded":
+                page.wait_for_load_state(self.wait_until, timeout=self.wait_timeout)
+            if self.wait_for_selector:
+                page.wait_for_selector(self.wait_for_selector, timeout=self.wait_timeout)
+        except PlaywrightTimeoutError:
+            logger.info("Stopped waiting for %s after %d ms", self.url, self.wait_timeout)
+
+        if self.remove_selectors:
+            page.evaluate(REMOVE_SELECTORS_SCRIPT, self.remove_selectors)
+
+        return page.content()
+
+    async def _aload_page(self, page: AsyncPage) -> str:
+        if self.block_resource_types or self.block_domains:
+            await page.route("**/*", self._aroute)
+        await page.goto(self.url, wait_until="domcontentloaded")
+        try:
+            if self.wait_until != "domcontentloaded":
+                await page.wait_for_load_state(self.wait_until, timeout=self.wait_timeout)
+            if self.wait_for_selector:
+                await page.wait_for_selector(self.wait_for_selector, timeout=self.wait_timeout)
+        except AsyncPlaywrightTimeoutError:
+            logger.info("Stopped waiting for %s after %d ms", self.url, self.wait_timeout)
+
+        if self.remove_selectors:
+            await page.evaluate(REMOVE_SELECTORS_SCRIPT, self.remove_selectors)
+
+        return await page.content()
+
+    def _handle_error(self, err: Exception) -> None:
+        if self.continue_on_failure:
+            logger.error(
+                "Error fetching or processing %s, exception: %s", self.url, err
+            )
+        else:
+            raise err
+
+    def _check_html(self) -> str:
         if self.html == '':
             raise Exception(f'Error when fetching the webpage {self.url}, please check the network condition or try again.')
-        return self.html
\ No newline at end of file
+        return self.html
+
+    def load(self) -> str:
+        """
+        Load the webpage from the page cache, or with plain HTTP if possible, else with the process-wide browser pool
+        """
+        cached = self._load_cached()
+        if cached is not None:
+            self.html = cached
+            return self.html
+        if self._can_use_http():
+            html = self._load_http()
+            if html is not None:
+                self.html = html
+                return self.html
+        try:
+            self.html = get_browser_pool(headless=self.headless).run(self._load_page)
+            self._cache_browser_html()
+        except Exception as err:  # pylint: disable=broad-except
+            self._handle_error(err)
+        return self._check_html()
+
+    async def aload(self, pool: AsyncBrowserPool) -> str:
+        """
+        Load the webpage with plain HTTP if possible, else with a browser pool of asyncio,
+        so several webpages can be loaded at the same time
+        """
+        cached = self._load_cached()
+        if cached is not None:
+            self.html = cached
+            return self.html
+        if self._can_use_http():
+            html = await asyncio.to_thread(self._load_http)
+            if html is not None:
+                self.html = html
+                return self.html
+        try:
+            self.html = await pool.run(self._aload_page)
+            self._cache_browser_html()
+        except Exception as err:  # pylint: disable=broad-except
+            self._handle_error(err)
+        return self._check_html()
+
+
+def load_urls(urls: List[str], headless: bool = True, max_pages: int = 4) -> List[Optional[str]]:
+    """
+    Load several webpages at the same time
+
+    Parameters:
+    urls (List[str]): the webpages to load
+    headless (bool): run the browser headless
+    max_pages (int): maximum number of webpages loading at the same time
+
+    Returns:
+    List[Optional[str]]: HTML of each webpage, None if it failed to load
+    """
+    async def load_all() -> List[Optional[str]]:
+        async with AsyncBrowserPool(size=max_pages, headless=headless) as pool:
+            loaders = [URLLoader(url=url, headless=headless) for url in urls]
+            results = await asyncio.gather(*[loader.aload(pool) for loader in loaders], return_exceptions=True)
+        return [None if isinstance(result, BaseException) else result for result in results]
+    return asyncio.run(load_all())
@@ -0,0 +1,235 @@
+"""
+Long-lived Chromium browsers shared by all the URLLoaders, so a browser is not launched for every webpage
+"""
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+from playwright.sync_api import sync_playwright, Page
+from playwright.async_api import async_playwright, Page as AsyncPage
+
+logger = logging.getLogger(__name__)
+T = TypeVar('T')
+
+
+class BrowserPool:
+    """
+    A bounded set of workers, each is a thread owning one Playwright instance, one browser and one context,
+    because objects of Playwright's sync API can only be used by the thread that created them.
+    Jobs can be submitted from any thread. A worker starts a new context after max_uses pages, and a new
+    browser if the browser crashed.
+    """
+
+    def __init__(self, size: int=2, max_uses: int=50, headless: bool=True):
+        self.size = size
+        self.max_uses = max_uses
+        self.headless = headless
+        self.jobs: queue.Queue = queue.Queue()
+        self.workers: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def run(self, job: Callable[[Page], T], timeout: Optional[float]=None) -> T:
+        """
+        Run job on a new page of one of the browsers, the page is closed afterwards
+
+        Parameters:
+        job (Callable[[Page], T]): function using the page
+        timeout (float or None): seconds to wait for the result
+
+        Returns:
+        T: what job returns, an exception raised by job is raised here
+        """
+        return self.submit(job).result(timeout=timeout)
+
+    def submit(self, job: Callable[[Page], T]) -> Future:
+        """
+        Same as run, but returns a Future instead of waiting
+        """
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('browser pool is already shut down')
+            # workers are started lazily, one more for every job until the pool is full
+            if len(self.workers) < self.size:
+                worker = threading.Thread(target=self._work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        future = Future()
+        self.jobs.put((job, future))
+        return future
+
+    def _work(self) -> None:
+        playwright = None
+        browser = None
+        context = None
+        uses = 0
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                break
+            job, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if browser is None or not browser.is_connected():
+                    _close_quietly(browser)
+                    if playwright is None:
+                        playwright = sync_playwright().start()
+                    browser = playwright.chromium.launch(headless=self.headless)
+                    context = None
+                if context is None:
+                    context = browser.new_context()
+                    uses = 0
+                page = context.new_page()
+                try:
+                    result = job(page)
+                finally:
+                    _close_quietly(page)
+                uses += 1
+                if uses >= self.max_uses:
+                    _close_quietly(context)
+                    context = None
+                future.set_result(result)
+            except Exception as err:  # pylint: disable=broad-except
+                future.set_exception(err)
+                # the page may have broken the context or crashed the browser, start a fresh context
+                _close_quietly(context)
+                context = None
+        _close_quietly(context)
+        _close_quietly(browser)
+        if playwright is not None:
+            try:
+                playwright.stop()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error("Error stopping playwright: %s", err)
+
+    def shutdown(self, timeout: Optional[float]=10) -> None:
+        """
+        Close all the browsers, jobs submitted before are still run
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for _ in self.workers:
+                self.jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout=timeout)
+
+
+def _close_quietly(closable) -> None:
+    if closable is None:
+        return
+    try:
+        closable.close()
+    except Exception as err:  # pylint: disable=broad-except
+        logger.debug("Error closing %s: %s", closable, err)
+
+
+_pools: Dict[bool, BrowserPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_browser_pool(headless: bool=True, size: int=2, max_uses: int=50) -> BrowserPool:
+    """
+    The process-wide browser pool, created on first use and shut down at exit
+    """
+    with _pools_lock:
+        if headless not in _pools:
+            if not _pools:
+                atexit.register(shutdown_browser_pools)
+            _pools[headless] = BrowserPool(size=size, max_uses=max_uses, headless=headless)
+        return _pools[headless]
+
+
+def shutdown_browser_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+class AsyncBrowserPool:
+    """
+    Browser pool for asyncio code, one browser with at most size pages open at the same time.
+    A context is reused for max_uses pages, and the browser is launched again if it crashed.
+
+    Usage:
+    async with AsyncBrowserPool(size=4) as pool:
+        htmls = await asyncio.gather(*[pool.run(job) for job in jobs])
+    """
+
+    def __init__(self, size: int=4, max_uses: int=50, headless: bool=True):
+        self.size = size
+        self.max_uses = max_uses
+        self.headless = headless
+        self.playwright = None
+        self.browser = None
+        self.semaphore: asyncio.Semaphore = None
+        self.launch_lock: asyncio.Lock = None
+        self.contexts: List = []  # idle contexts, as [context, uses]
+
+    async def __aenter__(self) -> 'AsyncBrowserPool':
+        self.semaphore = asyncio.Semaphore(self.size)
+        self.launch_lock = asyncio.Lock()
+        self.playwright = await async_playwright().start()
+        await self._ensure_browser()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback) -> None:
+        await self.close()
+
+    async def _ensure_browser(self) -> None:
+        async with self.launch_lock:
+            if self.browser is None or not self.browser.is_connected():
+                self.contexts = []
+                self.browser = await self.playwright.chromium.launch(headless=self.headless)
+
+    async def run(self, job: Callable[[AsyncPage], Awaitable[T]]) -> T:
+        """
+        Run job on a new page, the page is closed afterwards
+        """
+        async with self.semaphore:
+            await self._ensure_browser()
+            entry = self.contexts.pop() if self.contexts else [await self.browser.new_context(), 0]
+            page = await entry[0].new_page()
+            broken = False
+            try:
+                return await job(page)
+            except Exception:
+                broken = True
+                raise
+            finally:
+                try:
+                    await page.close()
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.debug("Error closing page: %s", err)
+                entry[1] += 1
+                if broken or entry[1] >= self.max_uses or not self.browser.is_connected():
+                    try:
+                        await entry[0].close()
+                    except Exception as err:  # pylint: disable=broad-except
+                        logger.debug("Error closing context: %s", err)
+                else:
+                    self.contexts.append(entry)
+
+    async def close(self) -> None:
+        for context, _ in self.contexts:
+            try:
+                await context.close()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.debug("Error closing context: %s", err)
+        self.contexts = []
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.debug("Error closing browser: %s", err)
+            self.browser = None
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
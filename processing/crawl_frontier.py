@@ -0,0 +1,123 @@
+"""
+The URLs to visit when answering a question, and polite concurrent fetching of them
+"""
+import heapq
+import threading
+from contextlib import contextmanager
+from time import monotonic, sleep
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from processing.http_fetch import get_domain
+from processing.page_cache import normalize_url
+
+
+class CrawlFrontier:
+    """
+    Priority queue of URLs, the URL with the highest score is visited first, URLs with the same score in the order
+    they were pushed. A URL (after normalization) is only pushed once, and URLs more than max_depth hops away from
+    the search results are not pushed. At most max_pages webpages are read: a page counts against the budget when
+    visit() is called for it, so URLs can be popped ahead to prefetch them, and put back if they are not read.
+    """
+
+    def __init__(self, max_pages: int=3, max_depth: int=2):
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.heap: List[Tuple[float, int, str, int]] = []  # (-score, push order, url, depth)
+        self.seen: Set[str] = set()
+        self.num_pushed = 0
+        self.num_visited = 0
+
+    def push(self, url: str, score: float, depth: int=0) -> bool:
+        """
+        Add a URL to visit
+
+        Parameters:
+        url (str): the URL
+        score (float): relevance of the URL, higher is visited first
+        depth (int): number of hops from the search results, 0 for a search result
+
+        Returns:
+        bool: whether the URL was added, False if it was seen before, is too deep or is not a valid URL
+        """
+        if depth > self.max_depth:
+            return False
+        try:
+            key = normalize_url(url)
+        except ValueError:
+            # e.g. a port that is not a number, in a link taken from the output of GPT
+            return False
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.requeue(url, score, depth)
+        return True
+
+    def requeue(self, url: str, score: float, depth: int) -> None:
+        """
+        Put back a popped URL that was not read
+        """
+        heapq.heappush(self.heap, (-score, self.num_pushed, url, depth))
+        self.num_pushed += 1
+
+    def pop(self) -> Optional[Tuple[str, float, int]]:
+        """
+        Take the next URL to visit
+
+        Returns:
+        (str, float, int) or None: the URL, its score and its depth, None if there is no URL left or the page budget is used
+        """
+        if len(self) == 0:
+            return None
+        neg_score, _, url, depth = heapq.heappop(self.heap)
+        return url, -neg_score, depth
+
+    def best_score(self) -> Optional[float]:
+        """
+        Score of the URL pop() would return, None if there is none
+        """
+        return -self.heap[0][0] if len(self) > 0 else None
+
+    def visit(self) -> None:
+        """
+        Count a webpage that is read against the budget
+        """
+        self.num_visited += 1
+
+    def remaining(self) -> int:
+        """
+        Number of webpages that can still be read
+        """
+        return max(0, self.max_pages - self.num_visited)
+
+    def __len__(self) -> int:
+        return len(self.heap) if self.remaining() > 0 else 0
+
+
+class DomainLimiter:
+    """
+    At most max_per_domain requests to the same domain at a time, and at least delay seconds between the
+    starts of two requests to the same domain
+    """
+
+    def __init__(self, max_per_domain: int=2, delay: float=1.0):
+        self.max_per_domain = max_per_domain
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.semaphores: Dict[str, threading.Semaphore] = {}
+        self.next_start: Dict[str, float] = {}
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """
+        Wait until a request to the domain of url is allowed, usage: with limiter.slot(url): fetch(url)
+        """
+        domain = get_domain(url)
+        with self.lock:
+            semaphore = self.semaphores.setdefault(domain, threading.Semaphore(self.max_per_domain))
+        with semaphore:
+            with self.lock:
+                now = monotonic()
+                start = max(now, self.next_start.get(domain, now))
+                self.next_start[domain] = start + self.delay
+            if start > now:
+                sleep(start - now)
+            yield
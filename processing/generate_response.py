@@ -1,15 +1,21 @@
 from googlesearch import search
-from utils.gpt import gpt3_chat, gpt4_chat
-from utils.gpt import gpt3_chat, gpt4_chat
+from utils.gpt import gpt4_chat, gpt4_chat_stream
 from processing.URLloader import URLLoader
 from processing.HTMLPreprocessor import HTMLPreprocessor
+from processing.crawl_frontier import CrawlFrontier, DomainLimiter
 from utils.animations.spinner import Spinner
 from utils.file_io import open_file
-from typing import List
+from utils.parallel import parallel_map, parallel_until
+from utils.keyword_index import preselect_chunks, order_chunks
+from utils.dedup import remove_contained
+from utils.grammar import get_grammar_checker
+from utils.tokens import chunk_token_budget, count_tokens
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
 import re
 import os
 import math
-import language_tool_python
+from concurrent.futures import ThreadPoolExecutor
 
 
 def get_prompt_path(prompt: str) -> str:
@@ -20,192 +26,473 @@ def find_links_in_str(string: str) -> List[str]:
     urls = re.findall(pattern, string)
     return urls
 
-def generate_response(user_input: str) -> str:
+# fields of the question analysis and their types
+ANALYSIS_FIELDS = {
+    'question': str,
+    'need_count': bool,
+    'is_list': bool,
+    'about_specific_thing': bool,
+    'search_query': str,
+    'keyword': (str, type(None)),
+}
+
+
+def parse_analysis(output: str) -> Dict:
+    """
+    Parse and validate the JSON from the question analysis
+
+    Returns:
+    Dict: the fields in ANALYSIS_FIELDS, keyword is None if there is no keyword
+
+    Raises:
+    ValueError: if the output is not a JSON object with all the fields of the right types
+    """
+    # the JSON may be in a markdown code block, or have some text around it
+    match = re.search(r'\{.*\}', output, flags=re.DOTALL)
+    if match is None:
+        raise ValueError('there is no JSON object in the output')
+    try:
+        analysis = json.loads(match.group(0))
+    except json.JSONDecodeError as err:
+        raise ValueError(f'the JSON is not valid: {err}') from err
+    if not isinstance(analysis, dict):
+        raise ValueError('the JSON is not an object')
+    for field, field_type in ANALYSIS_FIELDS.items():
+        if field not in analysis:
+            raise ValueError(f'field "{field}" is missing')
+        if not isinstance(analysis[field], field_type):
+            raise ValueError(f'field "{field}" has the wrong type')
+    if analysis['question'].strip() == '' or analysis['search_query'].strip() == '':
+        raise ValueError('"question" and "search_query" should not be empty')
+    keyword = (analysis['keyword'] or '').strip().strip('."\'').strip()
+    analysis['keyword'] = None if keyword == '' or 'NONE' in keyword else keyword
+    analysis['search_query'] = analysis['search_query'].strip().strip('"')
+    return {field: analysis[field] for field in ANALYSIS_FIELDS}
+
+
+def analyze_question(user_input: str) -> Dict:
+    """
+    Analyze the question with one GPT-4 call: the question without contractions (and without "How many" etc.),
+    whether need to count, whether the answer is a list, whether the question is about a specific thing,
+    the Google query and the keyword. If the output is not valid, GPT-4 is asked once to fix it.
+    """
+    prompt = open_file(get_prompt_path('analyze_question.txt'))
+    output = gpt4_chat(prompt, f'Question: {user_input}', log=True)
+    try:
+        return parse_analysis(output)
+    except ValueError as err:
+        repair = f'Question: {user_input}\n\nThis output is not valid, because {err}:\n{output}\n\nOutput the corrected JSON object only.'
+        output = gpt4_chat(prompt, repair, log=True)
+    try:
+        return parse_analysis(output)
+    except ValueError as err:
+        raise Exception(f'Question analysis did not return valid JSON: {err}') from err
+
+
+def parse_yesno(answer: str) -> Optional[bool]:
+    """
+    True or False if the answer starts with "Yes" or "No", else None
+    """
+    match = re.match(r'\W*(yes|no)\b', answer, flags=re.IGNORECASE)
+    if match is None:
+        return None
+    return match.group(1).lower() == 'yes'
+
+
+def read_yesno(stream: Iterator[str]) -> Tuple[Optional[bool], str]:
+    """
+    Read a streamed answer until its first word is known, and stop reading if the first word is Yes or No
+
+    Returns:
+    (bool or None, str): True or False if the answer starts with Yes or No, else None, and the text read,
+        the whole answer if it does not start with Yes or No
+    """
+    text = ''
+    for delta in stream:
+        text += delta
+        match = re.match(r'\W*(\w+)\W', text)
+        if match is not None:
+            if match.group(1).lower() in ('yes', 'no'):
+                stream.close()
+                return match.group(1).lower() == 'yes', text
+            # need the whole answer
+            text += ''.join(stream)
+            return None, text
+    return parse_yesno(text), text
+
+
+def ask_yesno(sys_prompt: str, user_prompt: str) -> bool:
+    """
+    Ask GPT-4 a Yes/No question, the answer is only read until its first word,
+    and only interpreted by GPT-4 again if it does not start with Yes or No
+    """
+    yesno, answer = read_yesno(gpt4_chat_stream(sys_prompt, f'{user_prompt}\nStart your answer with "Yes" or "No".', log=True))
+    if yesno is None:
+        yesno = answer_to_yesno(question=user_prompt, answer=answer)
+    return yesno
+
+
+# answers to a chunk that say the chunk does not answer the question, or are not sure
+_NO_ANSWER = re.compile(
+    r'^\W*none\b|not enough information|no information|no mention|not clear|'
+    r"does(?: not|n't) (?:mention|provide|contain|say|specify|state)|"
+    r"(?:cannot|can not|can't|could not|couldn't|unable to) (?:be )?(?:find|found|determine|answer)|"
+    r'not (?:mentioned|provided|specified)',
+    flags=re.IGNORECASE
+)
+# "may" only before a verb, "May" is also the month
+_HEDGES = re.compile(
+    r'\b(?:may (?:be|have|not|also|well|include|refer)|might|maybe|possibly|probably|perhaps|not sure|unclear|it seems|likely)\b',
+    flags=re.IGNORECASE
+)
+
+
+def is_confident_answer(answer: str) -> bool:
+    """
+    Whether the answer from one chunk answers the question without hedging, then the other chunks need not be asked
+    """
+    answer = answer.strip()
+    return (
+        len(answer) > 0
+        and not answer.startswith('GPT 3.5/4 error')
+        and _NO_ANSWER.search(answer) is None
+        and _HEDGES.search(answer) is None
+    )
+
+
+# the model answering the question on chunks of webpages, and the maximum number of tokens of an answer
+ANSWER_MODEL = 'gpt-4'
+ANSWER_TOKENS = 1024
+# chunks to find one thing or items of lists in stay small, so GPT-4 doesn't miss them in a long context
+SMALL_CHUNK_TOKENS = 1024
+
+
+def answer_prompt_template(title: str) -> str:
+    return open_file(get_prompt_path('answer.txt')).replace('<<TITLE>>', title)
+
+
+def answer_chunk_budget(user_input: str, title: str) -> int:
+    """
+    Number of tokens of a chunk that fit in the prompt of answer_chunks, besides the prompt template,
+    the question and the answer
+    """
+    prompt = answer_prompt_template(title).replace('<<CONTEXT>>', '')
+    return chunk_token_budget(ANSWER_MODEL, prompt, user_input, reply_tokens=ANSWER_TOKENS)
+
+
+def answer_chunks(
+    user_input: str,
+    title: str,
+    chunks: Iterable[str],
+    split_name: str,
+    max_in_flight: int=8,
+    stop_when_answered: bool=False,
+    query: Optional[str]=None
+) -> List[str]:
+    """
+    Answer the question on every chunk concurrently, with at most max_in_flight GPT-4 calls at a time
+
+    Parameters:
+    user_input (str): the question
+    title (str): title of the webpage
+    chunks (Iterable[str]): chunks of the webpage, answering starts while a generator is still producing chunks
+    split_name (str): name of the split, only used to show progress
+    max_in_flight (int): maximum number of GPT-4 calls at the same time
+    stop_when_answered (bool): for questions about one thing: ask the chunks most relevant to query first, in waves,
+        and stop asking once a chunk gives a confident answer
+    query (str or None): the text to rank the chunks with when stop_when_answered
+
+    Returns:
+    List[str]: answers, in the same order as chunks (in the order of relevance if stop_when_answered,
+        and only from the chunks that were asked)
+    """
+    prompt_template = answer_prompt_template(title)
+
+    def answer_chunk(chunk: str) -> str:
+        prompt_answer = prompt_template.replace('<<CONTEXT>>', chunk)
+        return gpt4_chat(prompt_answer, user_input, model=ANSWER_MODEL, tokens=ANSWER_TOKENS, log=True)
+
+    with Spinner(f"Generating answers({split_name})...") as spinner:
+        report_progress = lambda done, total: spinner.update_message(f"Generating answers({split_name}), progress: {done}/{total if total is not None else '?'}", delay=0)
+        if stop_when_answered:
+            return parallel_until(answer_chunk, order_chunks(chunks, query), is_confident_answer,
+                                  max_workers=max_in_flight, on_progress=report_progress)
+        return parallel_map(answer_chunk, chunks, max_workers=max_in_flight, on_progress=report_progress)
+
+
+def generate_response(
+    user_input: str,
+    max_in_flight: int=8,
+    preselect_ratio: float=0.1,
+    html_parser: str="html.parser",
+    on_delta: Optional[Callable[[str], None]]=None,
+    max_pages: int=3,
+    max_depth: int=2,
+    max_fetches: int=3
+) -> str:
+    """
+    Answer the question by searching Google and reading webpages
+
+    Parameters:
+    on_delta (Callable[[str], None] or None): called with each piece of the final answer as it is generated,
+        if the final answer is generated by GPT-4. The final answer is returned in any case.
+    max_pages (int): maximum number of webpages to visit
+    max_depth (int): maximum number of hyperlinks followed from a search result
+    max_fetches (int): maximum number of webpages fetched and preprocessed at the same time
+    """
     user_input = user_input.strip()
 
     with Spinner("Processing question..."):
         # Check question grammar
-        is_bad_rule = lambda rule: rule.message == 'Possible spelling mistake found.' and len(rule.replacements) and rule.replacements[0][0].isupper()
-        tool = language_tool_python.LanguageTool('en-US')
-        matches = tool.check(user_input)
-        matches = [rule for rule in matches if not is_bad_rule(rule)]
-        user_input = language_tool_python.utils.correct(user_input, matches)
-
-        # Remove all the contractions
-        prompt_remove_contraction = "Remove all the contractions in the user's input.\n\ne.g.\nWhat's -> What is\nWho's -> Who is"
-        user_input = gpt3_chat(prompt_remove_contraction, user_input)
-
-    # If need to do math, then there can't be any stride, else some stride will help not to miss information
-    with Spinner('Check whether need to count something'):
-        question_need_count = f'Does this question start with phrase like "Find the number of" or "Count the number of" or "How many" or "What\'s the number of"? question: {user_input}'
-        need_count_answer = gpt4_chat('', question_need_count)
-        need_count_answer = need_count_answer.strip()
-        if "Yes" in need_count_answer:
-            need_count = True
-            question_remove_count = f'In this sentence, replace phrase like "Find the number of" or "Count the number of" or "How many" or "What\'s the number of" to a single "Find". sentence: {user_input}'
-            user_input = gpt4_chat('', question_remove_count)
-        elif "No" in need_count_answer:
-            need_count = False
-        else:
-            raise Exception('Need math return neither yes nor no.')
-    
-    with Spinner('Check would the answer be a list'):
-        question_is_list = f'Would answer to this question "{user_input}" be a list? Start answer with "Yes" or "No"'
-        is_list_answer = gpt4_chat('', question_is_list, log=True)
-        is_list_answer = is_list_answer.strip()
-        if "Yes" in is_list_answer:
-            answer_is_list = True
-        elif "No" in need_count_answer:
-            answer_is_list = False
-        else:
-            raise Exception('would answer be a list return neither yes nor no.')
-    
-    with Spinner('Check what split size to use'):
-        prompt_size = f"The user's question would be related to a webpage."
-        size_answer = gpt4_chat(prompt_size, f'Question: {user_input}\nIs this question about one or some specific thing on the webpage? Answer Yes or No.', log=True)
-        size_answer = size_answer.strip()
-
-        if "yes" in size_answer or "Yes" in size_answer:
-            use_large_split = False
-        elif "no" in size_answer or "No" in size_answer:
-            use_large_split = True
-        else:
-            raise Exception('[Split size] return neither yes nor no')
-    
+        user_input = get_grammar_checker().correct(user_input)
+
+        # Remove all the contractions, check whether need to count something (if need to do math, then there can't
+        # be any stride, else some stride will help not to miss information), whether the answer would be a list,
+        # what split size to use, the Google query and the keyword, all in one call
+        analysis = analyze_question(user_input)
+    user_input = analysis['question']
+    need_count = analysis['need_count']
+    answer_is_list = analysis['is_list']
+    use_large_split = not analysis['about_specific_thing']
+    query = analysis['search_query']
+
+    # chunks not matching the keyword are not sent to GPT-4, but never filter out items of a list or things to count
+    keyword = analysis['keyword']
+    keep_ratio = 1.0 if (answer_is_list or need_count) and preselect_ratio > 0 else preselect_ratio
 
     # do a Google Search
-    prompt_query = f'Provide the best query to search Google to find answer to the question "{user_input}"'
-    query = gpt4_chat('', prompt_query, log=True)
-    if query.startswith('\"'):
-        query = query[1:-1]
     with Spinner('Searching Google...'):
         google_result = search(query, num_results=5)
-    urls_stack =  list(google_result)
-    urls_visited = []
+    # visit the webpages by relevance, hyperlinks that GPT-4 finds necessary go before the remaining search results
+    frontier = CrawlFrontier(max_pages=max_pages, max_depth=max_depth)
+    for rank, url in enumerate(google_result):
+        frontier.push(url, score=-rank)
+    limiter = DomainLimiter()
+    urls_answered = []
     webpages_info = []
     answers_wp = []
 
-    num_iter = 0
-    while num_iter < 1 and not len(urls_stack) == 0:
-        num_iter += 1
-        url = urls_stack.pop(0)
-        # if visited this url before, continue to next iteration
-        if url in urls_visited:
-            continue
-        # else add this url to the set
-        urls_visited.append(url)
-
-        answer_wp = None # this would be the answer after reading this webpage
-    
-        # Fetch and download the webpage
-        with Spinner("Fetching a new webpage... "):
-            loader = URLLoader(url=url, headless=True)
-            html = loader.load()
-        preprocessor = HTMLPreprocessor(html=html, base_url=url)
-
-        # summarize the webpage
-        with Spinner('Summarizing this webpage'):
-            wp_summary = preprocessor.summarize()
-
-        # check whether should look at this webpage
-        with Spinner('Checking whether this webpage is worth looking...'):
-            sys_prompt_info = f'Here is some information about one webpage:\n\nTitle: {preprocessor.title}\n\nSummary: {wp_summary}'
-            user_prompt_info = f'Do you think the content on this webpage may contain information to answer the question: {user_input}'
-            answer_should_look = gpt4_chat(sys_prompt_info, user_prompt_info, log=True)
-            should_look = answer_to_yesno(question=user_prompt_info, answer=answer_should_look)
-            if not should_look:
-                continue
-
-        # save information of webpage
-        webpages_info.append({'title': preprocessor.title, 'summary': wp_summary})
-
-        # Find useful hyperlinks and push them to the stack
-        with Spinner('Finding hyperlinks on this page...'):
-            hyperlinks = preprocessor.hyperlinks
-            num_parts = math.ceil(len(hyperlinks) / 50)
-            for i in range(num_parts):
-                links_group = hyperlinks[50 * i : (50 * i + 50) if (50 * i + 50) < len(hyperlinks) else len(hyperlinks)]
-                links_group_str = '\n'.join(links_group)
-                # ask gpt links to follow
-                sys_prompt_link = f'Here is some information about a webpage:\n\nURL of the webpage:{url}\n\nTitle of the webpage: {preprocessor.title}\n\nSummary of the webpage: {wp_summary}\n\nHere are some hyperlinks found on this webpage:\n{links_group_str}'
-                user_prompt_link = f'I am trying to find answer to the question "{user_input}", do you think reading this webpage is enough to answer this question, is there any hyperlinks on this webpage that is necessary to answer the question?'
-                links_res = gpt4_chat(sys_prompt_link, user_prompt_link, log=True)
-                links_to_follow = find_links_in_str(links_res)
-                # push useful links to the urls stack
-                urls_stack = links_to_follow + urls_stack
-        
-        if use_large_split:
-            answers = list()
-            split_large = preprocessor.build_split(window_size=10000, stride=8000)
-            for i, chunk in enumerate(split_large):
-                with Spinner(f"Generating answers(large split), progress: {i}/{len(split_large)}"):
-                    prompt_answer = open_file(get_prompt_path('answer.txt')).replace('<<TITLE>>', preprocessor.title).replace('<<CONTEXT>>', chunk)
-                    answer = gpt4_chat(prompt_answer, user_input, log=True)
-                    answers.append(answer)
-            answer_wp = put_answers_together(user_input, answers, answer_is_list=answer_is_list)
-        else:
-            # first go over split with a small window size
-            answers = list()
-            split_small = preprocessor.build_split(window_size=2000, stride=1800)
-            for i, chunk in enumerate(split_small):
-                with Spinner(f"Generating answers(small split), progress: {i}/{len(split_small)}"):
-                    prompt_answer = open_file(get_prompt_path('answer.txt')).replace('<<TITLE>>', preprocessor.title).replace('<<CONTEXT>>', chunk)
-                    answer = gpt4_chat(prompt_answer, user_input, log=True)
-                    answers.append(answer)
-            answer_wp = put_answers_together(user_input, answers, answer_is_list=answer_is_list)
-
-            # then go over all the parts with similar structure, which usually contains important information
-            try:
-                lists_answers = list()
-                split_list = preprocessor.build_lists_split(window_size=2000)
-                if (len(split_list) == 0):
-                    raise Exception('split all too large, not worth looking')
-                for i, chunk in enumerate(split_list):
-                    with Spinner(f"Generating answers(lists), progress: {i}/{len(split_list)}"):
-                        prompt_answer = open_file(get_prompt_path('answer.txt')).replace('<<TITLE>>', preprocessor.title).replace('<<CONTEXT>>', chunk)
-                        answer = gpt4_chat(prompt_answer, user_input, log=True)
-                        lists_answers.append(answer)
-                lists_answer_wp = put_answers_together(user_input, lists_answers, answer_is_list=answer_is_list)
-                answer_wp = put_answers_together(user_input, [answer_wp, lists_answer_wp], answer_is_list=answer_is_list)
-            except Exception as oops:
-                print('Error going over the "list", skip over it for now:', oops)
-
-        answers_wp.append(answer_wp)
-
-        # check whether the information that have been seen is enough to get an answer, if so, end the loop
-        with Spinner('Check whether should stop...'):
-            sys_prompt_enough = 'Here is some information about one or some webpages:\n'
-            for i, webpage_info in enumerate(webpages_info):
-                sys_prompt_enough += f'\n______\n{i}.\nTitle: {webpage_info["title"]}\n\nSummary: {webpage_info["summary"]}'
-            user_prompt_enough = f'Do you think the content on these webpages provides enough information to answer the question: {user_input}'
-            answer_enough = gpt4_chat(sys_prompt_enough, user_prompt_enough, log=True)
-
-            info_enough = answer_to_yesno(question=user_prompt_enough, answer=answer_enough)
-            if info_enough:
+    def fetch_page(url: str) -> HTMLPreprocessor:
+        with limiter.slot(url):
+            html = URLLoader(url=url, headless=True).load()
+        return HTMLPreprocessor(html=html, base_url=url, parser=html_parser)
+
+    # the next webpages are fetched and preprocessed while a webpage is being read
+    fetch_pool = ThreadPoolExecutor(max_workers=max(1, max_fetches))
+    fetches = []  # (score, url, depth, future) of the webpages being fetched, in the order they were popped
+    try:
+        while True:
+            # prefetch no more webpages than can still be read
+            while len(fetches) < min(max_fetches, frontier.remaining()):
+                item = frontier.pop()
+                if item is None:
+                    break
+                url, score, depth = item
+                fetches.append((score, url, depth, fetch_pool.submit(fetch_page, url)))
+            if frontier.remaining() == 0:
                 break
-    
+            # read the most relevant webpage first
+            best = max(range(len(fetches)), key=lambda i: (fetches[i][0], -i)) if fetches else None
+            if frontier.best_score() is not None and (best is None or frontier.best_score() > fetches[best][0]):
+                # a hyperlink more relevant than every prefetched webpage is fetched now and read next, the prefetched
+                # webpages are kept for later. Only a prefetched webpage whose fetch has not started gives its place.
+                worst = min(range(len(fetches)), key=lambda i: (fetches[i][0], -i)) if fetches else None
+                if len(fetches) >= max_fetches and fetches[worst][3].cancel():
+                    displaced_score, displaced_url, displaced_depth, _ = fetches.pop(worst)
+                    frontier.requeue(displaced_url, displaced_score, displaced_depth)
+                url, score, depth = frontier.pop()
+                future = fetch_pool.submit(fetch_page, url)
+            elif best is None:
+                break
+            else:
+                score, url, depth, future = fetches.pop(best)
+            frontier.visit()
+
+            answer_wp = None # this would be the answer after reading this webpage
+
+            # wait for the webpage to be fetched and preprocessed
+            with Spinner("Fetching a new webpage... "):
+                try:
+                    preprocessor = future.result()
+                except Exception as oops:
+                    print('Error fetching the webpage, skip over it:', url, oops)
+                    continue
+
+            # summarize the webpage
+            with Spinner('Summarizing this webpage'):
+                wp_summary = preprocessor.summarize(window_size=None, max_in_flight=max_in_flight, model=ANSWER_MODEL)
+
+            # check whether should look at this webpage
+            with Spinner('Checking whether this webpage is worth looking...'):
+                sys_prompt_info = f'Here is some information about one webpage:\n\nTitle: {preprocessor.title}\n\nSummary: {wp_summary}'
+                user_prompt_info = f'Do you think the content on this webpage may contain information to answer the question: {user_input}'
+                should_look = ask_yesno(sys_prompt_info, user_prompt_info)
+                if not should_look:
+                    continue
+
+            # save information of webpage
+            webpages_info.append({'title': preprocessor.title, 'summary': wp_summary})
+
+            # Find useful hyperlinks and push them to the frontier, unless no more webpages can be visited
+            with Spinner('Finding hyperlinks on this page...'):
+                hyperlinks = preprocessor.hyperlinks if depth < max_depth and frontier.remaining() > 0 else []
+                num_parts = math.ceil(len(hyperlinks) / 50)
+                links_groups = [hyperlinks[50 * i : 50 * i + 50] for i in range(num_parts)]
+
+                def find_links_to_follow(links_group: List[str]) -> List[str]:
+                    links_group_str = '\n'.join(links_group)
+                    # ask gpt links to follow
+                    sys_prompt_link = f'Here is some information about a webpage:\n\nURL of the webpage:{url}\n\nTitle of the webpage: {preprocessor.title}\n\nSummary of the webpage: {wp_summary}\n\nHere are some hyperlinks found on this webpage:\n{links_group_str}'
+                    user_prompt_link = f'I am trying to find answer to the question "{user_input}", do you think reading this webpage is enough to answer this question, is there any hyperlinks on this webpage that is necessary to answer the question?'
+                    links_res = gpt4_chat(sys_prompt_link, user_prompt_link, log=True)
+                    return find_links_in_str(links_res)
+
+                # the groups are asked at the same time, the links of the last group are visited first,
+                # same as asking one group after another and pushing each group to the front
+                for links_to_follow in reversed(parallel_map(find_links_to_follow, links_groups, max_workers=max_in_flight)):
+                    for link in links_to_follow:
+                        frontier.push(link, score=score + 1, depth=depth + 1)
+        
+            # chunks are measured in tokens, as many as fit in the prompt besides the template and the question
+            chunk_tokens = answer_chunk_budget(user_input, preprocessor.title)
+            if use_large_split:
+                split_large = preprocessor.iter_split(window_size=chunk_tokens, stride=chunk_tokens * 4 // 5, model=ANSWER_MODEL)
+                split_large = preselect_chunks(split_large, keyword, keep_ratio=keep_ratio)
+                answers = answer_chunks(user_input, preprocessor.title, split_large, 'large split', max_in_flight=max_in_flight)
+                answer_wp = put_answers_together(user_input, answers, answer_is_list=answer_is_list, max_in_flight=max_in_flight)
+            else:
+                # a question about one thing is usually answered by one chunk, stop once it is found,
+                # but every chunk is needed to find all the items of a list or to count
+                lookup = not answer_is_list and not need_count
+
+                # first go over split with a small window size
+                small_tokens = min(chunk_tokens, SMALL_CHUNK_TOKENS)
+                split_small = preprocessor.iter_split(window_size=small_tokens, stride=small_tokens * 9 // 10, model=ANSWER_MODEL)
+                split_small = preselect_chunks(split_small, keyword, keep_ratio=keep_ratio)
+                answers = answer_chunks(user_input, preprocessor.title, split_small, 'small split', max_in_flight=max_in_flight,
+                                        stop_when_answered=lookup, query=keyword or user_input)
+                answer_wp = put_answers_together(user_input, answers, answer_is_list=answer_is_list, max_in_flight=max_in_flight)
+
+                # then go over all the parts with similar structure, which usually contains important information,
+                # unless the question about one thing is already answered
+                if not (lookup and any(is_confident_answer(answer) for answer in answers)):
+                    try:
+                        split_list = preprocessor.build_lists_split(window_size=small_tokens, model=ANSWER_MODEL)
+                        split_list = preselect_chunks(split_list, keyword, keep_ratio=keep_ratio)
+                        if (len(split_list) == 0):
+                            raise Exception('split all too large, not worth looking')
+                        lists_answers = answer_chunks(user_input, preprocessor.title, split_list, 'lists', max_in_flight=max_in_flight,
+                                                      stop_when_answered=lookup, query=keyword or user_input)
+                        lists_answer_wp = put_answers_together(user_input, lists_answers, answer_is_list=answer_is_list, max_in_flight=max_in_flight)
+                        answer_wp = put_answers_together(user_input, [answer_wp, lists_answer_wp], answer_is_list=answer_is_list, max_in_flight=max_in_flight)
+                    except Exception as oops:
+                        print('Error going over the "list", skip over it for now:', oops)
+
+            answers_wp.append(answer_wp)
+            urls_answered.append(url)
+
+            # check whether the information that have been seen is enough to get an answer, if so, end the loop
+            with Spinner('Check whether should stop...'):
+                sys_prompt_enough = 'Here is some information about one or some webpages:\n'
+                for i, webpage_info in enumerate(webpages_info):
+                    sys_prompt_enough += f'\n______\n{i}.\nTitle: {webpage_info["title"]}\n\nSummary: {webpage_info["summary"]}'
+                user_prompt_enough = f'Do you think the content on these webpages provides enough information to answer the question: {user_input}'
+                info_enough = ask_yesno(sys_prompt_enough, user_prompt_enough)
+                if info_enough:
+                    break
+    finally:
+        # webpages that are not needed any more
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+
     # Combine all the answers to a final answer
     if answer_is_list:
-        final = "\n\n".join([f"Answer according to webpage {urls_visited[i]}" + answers_wp[i] for i in range(len(answers_wp))])
+        final = "\n\n".join([f"Answer according to webpage {urls_answered[i]}" + answers_wp[i] for i in range(len(answers_wp))])
     else:
-        final = put_answers_together(user_input, answers_wp, count_number=need_count, answer_is_list=False)
+        final = put_answers_together(user_input, answers_wp, count_number=need_count, answer_is_list=False, on_delta=on_delta,
+                                     max_in_flight=max_in_flight)
     return final
         
 
-def put_answers_together(user_input, answers, count_number=False, answer_is_list=False):
-    if len(answers) == 1:
-        return answers
+# answers saying there is nothing in their part, they add nothing to the final answer
+_EMPTY_ANSWER = re.compile(r'^\W*(?:none\W*)?$', flags=re.IGNORECASE)
+# at most this many answers (and tokens of answers) are formatted as a list in one GPT-4 call, so the list fits in the reply
+FORMAT_BATCH_SIZE = 5
+FORMAT_BATCH_TOKENS = 512
+# at most this many answers are put together in one GPT-4 call, more answers are put together level by level like a tree
+PUT_TOGETHER_FAN_IN = 8
+
+
+def is_empty_answer(answer: Optional[str]) -> bool:
+    return answer is None or _EMPTY_ANSWER.match(answer) is not None
+
+
+def group_answers(answers: List[str], max_size: int, max_tokens: int) -> List[List[str]]:
+    """
+    Group consecutive answers, each group has at most max_size answers and max_tokens tokens,
+    an answer longer than max_tokens would be in a group by itself
+    """
+    groups: List[List[str]] = []
+    group_tokens = 0
+    for answer in answers:
+        tokens = count_tokens(answer, ANSWER_MODEL)
+        if groups and len(groups[-1]) < max_size and group_tokens + tokens <= max_tokens:
+            groups[-1].append(answer)
+            group_tokens += tokens
+        else:
+            groups.append([answer])
+            group_tokens = tokens
+    return groups
+
+
+def put_answers_together(
+    user_input: str,
+    answers: List[Optional[str]],
+    count_number: bool=False,
+    answer_is_list: bool=False,
+    on_delta: Optional[Callable[[str], None]]=None,
+    max_in_flight: int=8
+):
+    """
+    Combine the answers from parts of webpages to one answer. "None." and empty answers are dropped without asking GPT-4.
+    For lists, the answers are formatted as lists in batches at the same time, then the items are merged and deduplicated.
+    Else the answers are put together by GPT-4, at most PUT_TOGETHER_FAN_IN at a time: groups of answers are put
+    together at the same time, then groups of those, until one answer is left.
+
+    Parameters:
+    user_input (str): the question
+    answers (List[str or None]): the answers, in the order of the parts
+    count_number (bool): return the number of items of the list instead
+    answer_is_list (bool): the answer is a list of items
+    on_delta (Callable[[str], None] or None): called with each piece of the final answer as it is generated,
+        if it is generated by GPT-4 (not a list)
+    max_in_flight (int): maximum number of GPT-4 calls at the same time
+
+    Returns:
+    str or int: the answer, "None." if no part has an answer, the number of items if count_number
+    """
+    answers = [answer for answer in answers if not is_empty_answer(answer)]
+    if len(answers) == 0:
+        return 0 if count_number else 'None.'
+    if len(answers) == 1 and not count_number:
+        return answers[0]
     
     if answer_is_list or count_number:
         with Spinner('formatting and putting answers together'):
-            formatted_answers = []
+            answers = [answer for answer in answers if 'None' not in answer and 'NONE' not in answer]
+            if len(answers) == 0:
+                return 0 if count_number else 'None.'
 
-            for answer in answers:
-                if 'None' not in answer and 'NONE' not in answer:
-                    sys_prompt_format = 'Here is answer to one question:\n\n' + answer
+            def format_answers(batch: List[str]) -> str:
+                if len(batch) == 1:
+                    sys_prompt_format = 'Here is answer to one question:\n\n' + batch[0]
                     user_prompt_format = 'Write this answer in this format:\ne.g.\nThe students graduating in 2024 are Isaac Zheng and Mark Zhang should be written in this format:\n- Isaac Zheng\n- Mark Zhang'
-                    formatted_answer = gpt4_chat(sys_prompt_format, user_prompt_format)
-                    formatted_answers.append(formatted_answer)
+                else:
+                    sys_prompt_format = 'Here are some answers to one question:\n\n' + '\n______\n'.join(batch)
+                    user_prompt_format = 'Write all the items in these answers in one list in this format:\ne.g.\nThe students graduating in 2024 are Isaac Zheng and Mark Zhang should be written in this format:\n- Isaac Zheng\n- Mark Zhang'
+                return gpt4_chat(sys_prompt_format, user_prompt_format)
+
+            batches = group_answers(answers, FORMAT_BATCH_SIZE, FORMAT_BATCH_TOKENS)
+            formatted_answers = parallel_map(format_answers, batches, max_workers=max_in_flight)
             
             answer_lines: list[str] = []
 
@@ -215,40 +502,62 @@ def put_answers_together(user_input, answers, count_number=False, answer_is_list
             # remove all the punctuations and decorators at the beginning of each line
             answer_lines = [re.sub(r'^[-*\d.]+', '', answer_line.strip()).strip() for answer_line in answer_lines]
 
-            # remove duplicates in this list
-            i = 0
-            while i < len(answer_lines):
-                j = 0
-                while j < len(answer_lines):
-                    if j != i:
-                        # if one element is in another element, remove it
-                        if answer_lines[i] in answer_lines[j]:
-                            answer_lines.pop(i)
-                            i -= 1
-                            break
-                    j += 1
-                i += 1
+            # remove duplicates in this list, and lines contained in another line
+            answer_lines = remove_contained(answer_lines)
             if count_number:
                 return len(answer_lines)
             
             final = '\n'.join(answer_lines)
-            with open('temp.txt', 'w') as f:
-                f.write(final)
 
     else:
+        prompt_template = open_file(get_prompt_path('put_together.txt')).replace('<<QUESTION>>', user_input)
+        put_together_prompt = f'Based on answers, generate a final answer to the question "{user_input}"'
+        # the answers of a group and their "partN: " labels must fit in the prompt
+        max_tokens = chunk_token_budget(ANSWER_MODEL, prompt_template.replace('<<ANSWERS>>', ''), put_together_prompt,
+                                        round_to=1) - 8 * PUT_TOGETHER_FAN_IN
+
+        def prompt_answers(group: List[str]) -> str:
+            answers_str = '\n\n'.join(f'part{i+1}: ' + answer for i, answer in enumerate(group))
+            return prompt_template.replace('<<ANSWERS>>', answers_str)
+
+        def put_group_together(group: List[str]) -> str:
+            if len(group) == 1:
+                return group[0]
+            return gpt4_chat(prompt_answers(group), put_together_prompt)
+
         with Spinner('Putting answers together...'):
-            answers = [f'part{i+1}: ' + answer for i, answer in enumerate(answers)]
-            answers_str = '\n\n'.join(answers)
-            prompt_summary = open_file(get_prompt_path('put_together.txt')).replace('<<QUESTION>>', user_input).replace('<<ANSWERS>>', answers_str)
-            put_together_prompt = f'Based on answers, generate a final answer to the question "{user_input}"'
-            final = gpt4_chat(prompt_summary, put_together_prompt)
+            # reduce: while the answers are too many for one prompt, put groups of consecutive answers together
+            while len(answers) > 1:
+                groups = group_answers(answers, PUT_TOGETHER_FAN_IN, max_tokens)
+                if len(groups) == 1 or len(groups) == len(answers):
+                    # one prompt is enough, or no two answers fit in one prompt and reducing would not make progress
+                    break
+                answers = [answer for answer in parallel_map(put_group_together, groups, max_workers=max_in_flight)
+                           if not is_empty_answer(answer)]
+        if len(answers) == 0:
+            return 'None.'
+        if len(answers) == 1:
+            return answers[0]
+        if on_delta is None:
+            with Spinner('Putting answers together...'):
+                final = gpt4_chat(prompt_answers(answers), put_together_prompt)
+        else:
+            # no spinner, it would write over the streamed answer
+            pieces = []
+            for delta in gpt4_chat_stream(prompt_answers(answers), put_together_prompt):
+                on_delta(delta)
+                pieces.append(delta)
+            final = ''.join(pieces)
     return final
 
 
 def answer_to_yesno(question: str, answer: str) -> bool:
     sys_prompt = f'Question: {question}\n\nAnswer: {answer}'
     user_prompt = 'Is this answer a "Yes" answer or a "No" answer?'
-    yesno_answer = gpt4_chat(sys_prompt, user_prompt)
+    # usually starts with Yes or No, the rest of the explanation is not read
+    yesno, yesno_answer = read_yesno(gpt4_chat_stream(sys_prompt, user_prompt))
+    if yesno is not None:
+        return yesno
     if 'yes' in yesno_answer or 'Yes' in yesno_answer:
         return True
     elif 'no' in yesno_answer or 'No' in yesno_answer:
@@ -0,0 +1,146 @@
+"""
+Fetch webpages with plain HTTP, and decide per domain whether a headless browser is needed
+"""
+import re
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from processing.page_cache import PageCache
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+# (connect timeout, read timeout) in seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# phrases of pages that only show their content after running JavaScript
+_JS_MARKERS = [
+    "enable javascript", "javascript is required", "javascript is disabled", "requires javascript",
+    "javascript must be enabled", "turn on javascript", "browser does not support javascript",
+]
+_EMPTY_APP_ROOT = re.compile(r'<div[^>]+id=["\'](root|app|__next|__nuxt)["\'][^>]*>\s*</div>', re.IGNORECASE)
+_INVISIBLE_BLOCKS = re.compile(r'<(script|style|noscript|template|svg)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r'<[^>]*>')
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([a-zA-Z0-9_-]+)', re.IGNORECASE)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# "http" if plain HTTP returned the complete page of the domain before, "browser" if it didn't
+_domain_modes: Dict[str, str] = {}
+_domain_modes_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    The process-wide HTTP session, connections are kept alive and reused, and compressed responses are accepted
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers.update(DEFAULT_HEADERS)
+        return _session
+
+
+def get_domain(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+def get_domain_mode(url: str) -> Optional[str]:
+    """
+    "http" or "browser" if the domain of url was fetched before, else None
+    """
+    with _domain_modes_lock:
+        return _domain_modes.get(get_domain(url))
+
+
+def set_domain_mode(url: str, mode: str) -> None:
+    with _domain_modes_lock:
+        _domain_modes[get_domain(url)] = mode
+
+
+def decode_html(content: bytes, content_type: str) -> str:
+    """
+    Decode the body with the charset in the Content-Type header, or in a <meta> tag, or UTF-8
+    """
+    match = re.search(r'charset=([^\s;]+)', content_type or "", re.IGNORECASE)
+    charset = match.group(1).strip('"\'') if match else None
+    if not charset:
+        meta = _META_CHARSET.search(content[:4096])
+        charset = meta.group(1).decode("ascii") if meta else "utf-8"
+    try:
+        return content.decode(charset, errors="replace")
+    except LookupError:
+        return content.decode("utf-8", errors="replace")
+
+
+def looks_js_rendered(html: str, min_text_len: int=200, min_text_ratio: float=0.005) -> bool:
+    """
+    Guess whether the HTML returned by plain HTTP is missing content that JavaScript would render
+
+    Parameters:
+    html (str): the HTML
+    min_text_len (int): a page with less visible text than this is considered not rendered
+    min_text_ratio (float): a page whose visible text is a smaller fraction of its markup is considered not rendered
+    """
+    if len(html.strip()) == 0:
+        return True
+    if _EMPTY_APP_ROOT.search(html):
+        return True
+    text = _TAG.sub(" ", _INVISIBLE_BLOCKS.sub(" ", html))
+    text_len = len(" ".join(text.split()))
+    if text_len < min_text_len or text_len < min_text_ratio * len(html):
+        return True
+    lower_text = text.lower()
+    # a short page asking for JavaScript, long pages often mention JavaScript in a <noscript> banner only
+    return text_len < 2000 and any(marker in lower_text for marker in _JS_MARKERS)
+
+
+def fetch_http(url: str, timeout: Tuple[float, float]=DEFAULT_TIMEOUT, headers: Optional[Dict[str, str]]=None) -> requests.Response:
+    """
+    GET the url with the shared session, redirects are followed
+    """
+    return get_session().get(url, timeout=timeout, headers=headers, allow_redirects=True)
+
+
+def fetch_html_http(url: str, timeout: Tuple[float, float]=DEFAULT_TIMEOUT, page_cache: Optional[PageCache]=None) -> Optional[str]:
+    """
+    Try to get the complete webpage with plain HTTP. Whether the domain needs a browser is recorded.
+    If the webpage is in page_cache, it is revalidated with a conditional request, and the cached webpage
+    is used if the server says it did not change.
+
+    Returns:
+    str or None: the HTML, None if a browser should be used (error response, not HTML, or rendered by JavaScript)
+    """
+    cached = page_cache.get(url) if page_cache else None
+    headers = dict()
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+    response = fetch_http(url, timeout=timeout, headers=headers or None)
+    if response.status_code == 304 and cached:
+        page_cache.refresh(url)
+        return cached["html"]
+    if response.status_code in (401, 403, 429):
+        # often a bot check that a real browser passes
+        set_domain_mode(url, "browser")
+        return None
+    if response.status_code != 200 or "html" not in response.headers.get("Content-Type", "text/html").lower():
+        return None
+    html = decode_html(response.content, response.headers.get("Content-Type", ""))
+    if looks_js_rendered(html):
+        set_domain_mode(url, "browser")
+        return None
+    set_domain_mode(url, "http")
+    if page_cache:
+        page_cache.put(url, html, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+    return html
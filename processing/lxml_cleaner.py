@@ -0,0 +1,144 @@
+"""
+Cleaning passes of HTMLPreprocessor run on an lxml tree, the fast parser backend.
+Does the same as the passes of HTMLPreprocessor on a BeautifulSoup: remove scripts, styles, head, hidden elements,
+header, footer and sidebars, and collect the title and the hyperlinks. Everything runs in libxml2 and XPath, only
+the cleaned body is handed to BeautifulSoup afterwards.
+"""
+from typing import Dict, List, Optional, Tuple
+import lxml.html
+from lxml.etree import ParserError
+
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8", remove_comments=True)
+# text of a link without the text of scripts and styles in it
+_LINK_TEXT = ".//text()[not(ancestor::script or ancestor::style)]"
+# tags in which BeautifulSoup keeps the whitespace as it is
+_PRESERVE_WHITESPACE = {"pre", "textarea"}
+
+
+def _has_class(name: str) -> str:
+    # XPath matching elements that have the class name among their classes
+    return f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]"
+
+
+def _element_children(node: lxml.html.HtmlElement) -> List[lxml.html.HtmlElement]:
+    # comments and processing instructions are children in lxml, but not in BeautifulSoup's find_all
+    return [child for child in node if isinstance(child.tag, str)]
+
+
+def _source(node: lxml.html.HtmlElement) -> str:
+    return lxml.html.tostring(node, encoding="unicode", method="html", with_tail=False)
+
+
+def _drop(node: lxml.html.HtmlElement) -> None:
+    # drop_tree joins the text before and after the node into one string, while BeautifulSoup's extract() leaves two
+    # strings that prettify puts on separate lines, so they end up separated by a space in the markdown
+    tail = node.tail
+    if tail and not tail[0].isspace():
+        previous = node.getprevious()
+        before = previous.tail if previous is not None else node.getparent().text
+        if before and not before[-1].isspace() and not any(
+                ancestor.tag in _PRESERVE_WHITESPACE for ancestor in node.iterancestors()):
+            node.tail = " " + tail
+    node.drop_tree()
+
+
+def _find_first(root: lxml.html.HtmlElement, tag: str) -> Optional[lxml.html.HtmlElement]:
+    # the tag, else an element with the class, else an element with the id, same order as in extract_header_footer
+    for xpath in (f"//{tag}", _has_class(tag), f"//*[@id='{tag}']"):
+        found = root.xpath(xpath)
+        if found:
+            return found[0]
+    return None
+
+
+def _remove_hidden(node: lxml.html.HtmlElement) -> None:
+    children = _element_children(node)
+    if len(children) == 0:
+        return
+    style = node.get("style")
+    if style:
+        if ("display" in style and "none" in style) or ("visibility" in style and "hidden" in node.attrib):
+            _drop(node)
+            return
+    for child in children:
+        _remove_hidden(child)
+
+
+def _remove_sidebars(node: lxml.html.HtmlElement, sidebars: List[str]) -> None:
+    if "sidebar" in node.get("class", "").split() or node.get("id") == "sidebar":
+        sidebars.append(_source(node))
+        _drop(node)
+        return
+    for child in _element_children(node):
+        _remove_sidebars(child, sidebars)
+
+
+def clean_html(html: str, find_links: bool=True) -> Dict:
+    """
+    Parse and clean the HTML with lxml
+
+    Parameters:
+    html (str): HTML source, already joined into one line like HTMLPreprocessor does
+    find_links (bool): whether to collect the hyperlinks
+
+    Returns:
+    Dict: {
+        "title": str or None,
+        "links": List[Tuple[str, str]], text and href of every <a> with a href, in document order,
+        "header": str or None, "footer": str or None, HTML source of the removed header and footer,
+        "sidebars": List[str], HTML source of the removed sidebars,
+        "body": str, HTML source of the cleaned body
+    }
+    """
+    try:
+        root = lxml.html.document_fromstring(html.encode("utf-8", errors="surrogatepass"), parser=_HTML_PARSER)
+    except ParserError:
+        # nothing but whitespace
+        root = lxml.html.document_fromstring("<html><body></body></html>")
+
+    links: List[Tuple[str, str]] = []
+    if find_links:
+        # before scripts are dropped, the text of a link is its strings joined without a separator, like BeautifulSoup's .text
+        links = [("".join(link.xpath(_LINK_TEXT)), link.get("href")) for link in root.xpath("//a[@href][not(ancestor::head)]")]
+
+    # remove scripts and styles, the text after the element is kept like extract() does
+    for element in root.xpath("//script | //style"):
+        _drop(element)
+
+    title = root.find(".//title")
+    # same as BeautifulSoup's .string: the text of a title without child elements
+    title = title.text if title is not None and len(title) == 0 else None
+
+    head = root.find("head")
+    if head is not None:
+        _drop(head)
+
+    body = root.find("body")
+    if body is None:
+        body = lxml.html.Element("body")
+        root.append(body)
+
+    _remove_hidden(body)
+
+    header = _find_first(root, "header")
+    header_source = None
+    if header is not None:
+        header_source = _source(header)
+        _drop(header)
+    footer = _find_first(root, "footer")
+    footer_source = None
+    if footer is not None:
+        footer_source = _source(footer)
+        _drop(footer)
+
+    sidebars: List[str] = []
+    _remove_sidebars(body, sidebars)
+
+    return {
+        "title": title if title else None,
+        "links": links,
+        "header": header_source,
+        "footer": footer_source,
+        "sidebars": sidebars,
+        "body": _source(body),
+    }
@@ -0,0 +1,91 @@
+"""
+On-disk cache of fetched webpages, keyed by normalized URL
+"""
+import json
+import os
+import threading
+import zlib
+from time import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from utils.cache import SQLiteCache
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so that the same webpage always has the same URL: lowercase scheme and host,
+    no default port, no fragment, sorted query parameters, and "/" for an empty path
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+class PageCache:
+    """
+    Cache of webpages with their ETag and Last-Modified, bodies are compressed.
+    An entry younger than ttl seconds is fresh and can be used without any network request, an older entry can
+    still be revalidated with a conditional request. When the cache is larger than max_size bytes, the least
+    recently used webpages are dropped.
+    """
+
+    def __init__(self, db_file: str, ttl: float=24 * 3600, max_size: Optional[int]=256 * 1024 * 1024):
+        self.ttl = ttl
+        self.cache = SQLiteCache(db_file, max_size=max_size)
+
+    def get(self, url: str) -> Optional[Dict]:
+        """
+        Get the cached webpage
+
+        Returns:
+        Dict or None: {"html", "etag", "last_modified", "fresh"}, None if the webpage is not cached
+        """
+        entry = self.cache.get_entry(normalize_url(url))
+        if entry is None:
+            return None
+        value, created = entry
+        header, body = value.split(b"\n", 1)
+        page = json.loads(header)
+        page["html"] = zlib.decompress(body).decode("utf-8")
+        page["fresh"] = created >= time() - self.ttl
+        return page
+
+    def put(self, url: str, html: str, etag: Optional[str]=None, last_modified: Optional[str]=None) -> None:
+        header = json.dumps({"etag": etag, "last_modified": last_modified}).encode("utf-8")
+        self.cache.set(normalize_url(url), header + b"\n" + zlib.compress(html.encode("utf-8"), 6))
+
+    def refresh(self, url: str) -> None:
+        """
+        Mark the cached webpage as fresh again, after the server said it did not change
+        """
+        self.cache.touch(normalize_url(url))
+
+
+_page_cache: Optional[PageCache] = None
+_page_cache_configured = False
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> Optional[PageCache]:
+    """
+    The process-wide page cache, configured from the environment on first use, None if disabled.
+    PAGE_CACHE ("on" or "off", default "on"), PAGE_CACHE_FILE (default "page_cache/pages.sqlite3"),
+    PAGE_CACHE_TTL_HOURS (default 24), PAGE_CACHE_MAX_SIZE_MB (default 256)
+    """
+    global _page_cache, _page_cache_configured
+    with _page_cache_lock:
+        if not _page_cache_configured:
+            if os.getenv("PAGE_CACHE", "on").lower() != "off":
+                _page_cache = PageCache(
+                    os.getenv("PAGE_CACHE_FILE", os.path.join("page_cache", "pages.sqlite3")),
+                    ttl=float(os.getenv("PAGE_CACHE_TTL_HOURS", 24)) * 3600,
+                    max_size=int(float(os.getenv("PAGE_CACHE_MAX_SIZE_MB", 256)) * 1024 * 1024),
+                )
+            _page_cache_configured = True
+        return _page_cache
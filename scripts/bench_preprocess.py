@@ -0,0 +1,110 @@
+"""
+Compare the "html.parser" and "lxml" backends of HTMLPreprocessor on stored webpages:
+parse time, peak memory, and whether both give the same results
+
+usage: python scripts/bench_preprocess.py page1.html page2.html ...
+    without files, synthetic webpages of 100 KB - 5 MB are used
+"""
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+PARSERS = ['html.parser', 'lxml']
+SPLITS = [(2000, 1800), (6000, 6000), (20000, 20000)]
+
+
+def make_html(size: int, seed: int=0) -> str:
+    """
+    A well-formed webpage with lists, tables, hidden elements, a header, a footer and a sidebar,
+    and scripts, hidden elements and sidebars between two pieces of text
+    """
+    rand = random.Random(seed)
+    words = ['department', 'of', 'physics', 'professor', 'Isaac', 'Zheng', 'research', 'the', 'and']
+    text = lambda: ' '.join(rand.choice(words) for _ in range(rand.randint(1, 12)))
+    pieces = ['<html><head><title>Benchmark</title><style>p {}</style></head><body>',
+              '<header><a href="/">Home</a> <a href="/about">About</a></header>',
+              '<div class="sidebar"><a href="/a">%s</a></div>' % text()]
+    length = 0
+    while length < size:
+        kind = rand.random()
+        if kind < 0.3:
+            piece = '<ul class="people">%s</ul>' % ''.join(
+                '<li class="person"><a href="/p/%d">%s</a><span>%s</span></li>' % (i, text(), text()) for i in range(rand.randint(3, 20)))
+        elif kind < 0.45:
+            piece = '<table>%s</table>' % ''.join('<tr><td>%s</td><td>%s</td></tr>' % (text(), text()) for _ in range(rand.randint(2, 10)))
+        elif kind < 0.5:
+            piece = '<div style="display: none"><p>%s</p><p>%s</p></div>' % (text(), text())
+        elif kind < 0.6:
+            inline = rand.choice(['<script>var y = 2;</script>', '<style>b {}</style>', '<span style="display: none"><b>%s</b></span>' % text(),
+                                  '<span class="sidebar"><b>%s</b></span>' % text()])
+            piece = '<p>%s%s%s <a href="/q">%s<script>q();</script>%s</a></p>\n' % (text(), inline, text(), text(), text())
+        else:
+            piece = '<section><h2>%s</h2>\n<p>%s <b>%s</b></p>\n<p>%s</p></section>\n' % (text(), text(), text(), text())
+        pieces.append(piece)
+        length += len(piece)
+    pieces.append('<div id="footer">Copyright <b>2023</b></div><script>var x = 1;</script></body></html>')
+    return ''.join(pieces)
+
+
+def run_worker(parser: str, files: list) -> None:
+    """Preprocess every webpage with one backend, print the measurements and the results as JSON lines"""
+    from processing.HTMLPreprocessor import HTMLPreprocessor
+    for name in files:
+        html = open(name, encoding='utf-8').read() if os.path.exists(name) else make_html(int(name))
+        tracemalloc.start()
+        start = perf_counter()
+        preprocessor = HTMLPreprocessor(html, base_url='https://example.com/', use_cache=False, parser=parser)
+        elapsed = perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result = {
+            'title': preprocessor.title,
+            'hyperlinks': preprocessor.hyperlinks,
+            'header': preprocessor.header['markdown'],
+            'footer': preprocessor.footer['markdown'],
+            'sidebars': [sidebar['markdown'] for sidebar in preprocessor.sidebars],
+            'markdown': preprocessor.complete_markdown,
+            'splits': [preprocessor.build_split(window_size=w, stride=s) for w, s in SPLITS],
+            'lists_split': preprocessor.build_lists_split(window_size=6000),
+        }
+        print(json.dumps({'file': name, 'size': len(html), 'seconds': elapsed, 'peak': peak, 'result': result}))
+    # maximum resident set size, includes the memory of libxml2 that tracemalloc can't see
+    print(json.dumps({'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def main():
+    files = sys.argv[1:] or [str(size) for size in [100_000, 1_000_000, 5_000_000]]
+    runs = {}
+    for parser in PARSERS:
+        # one process per backend, so the maximum resident set sizes are comparable
+        output = subprocess.run([sys.executable, __file__, '--worker', parser] + files,
+                                capture_output=True, text=True, check=True).stdout
+        lines = [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+        runs[parser] = lines
+    reference, fast = runs['html.parser'], runs['lxml']
+    print('%-30s %9s %12s %12s %14s %14s  %s' % (
+        'page', 'size', 'html.parser', 'lxml', 'peak (ref)', 'peak (lxml)', 'same results'))
+    mismatches = 0
+    for ref, lx in zip(reference[:-1], fast[:-1]):
+        different = [key for key in ref['result'] if ref['result'][key] != lx['result'][key]]
+        mismatches += bool(different)
+        print('%-30s %8dK %11.3fs %11.3fs %13.1fM %13.1fM  %s' % (
+            os.path.basename(ref['file'])[:30], ref['size'] // 1000, ref['seconds'], lx['seconds'],
+            ref['peak'] / 1e6, lx['peak'] / 1e6, 'yes' if not different else 'no: ' + ', '.join(different)))
+    print('max RSS: html.parser %.1fM, lxml %.1fM' % (reference[-1]['maxrss_kb'] / 1e3, fast[-1]['maxrss_kb'] / 1e3))
+    print('%d of %d pages differ' % (mismatches, len(files)))
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--worker':
+        run_worker(sys.argv[2], sys.argv[3:])
+    else:
+        main()
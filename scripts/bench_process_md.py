@@ -0,0 +1,48 @@
+"""
+Micro-benchmark of the markdown post-processing in utils.process_md on 100 KB - 10 MB inputs
+
+usage: python scripts/bench_process_md.py
+"""
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.process_md import remove_links, format_md, remove_multi_line_breaks, clean_md
+
+
+def make_markdown(size: int, seed: int=0) -> str:
+    """Markdown that looks like html2text output: links, list items, and lines starting with punctuation"""
+    rand = random.Random(seed)
+    words = ['department', 'of', 'physics', 'professor', 'Isaac', 'Zheng', 'research', 'the', 'and']
+    pieces = []
+    length = 0
+    while length < size:
+        kind = rand.random()
+        if kind < 0.3:
+            piece = '[%s](https://example.com/%s/%d)' % (rand.choice(words), rand.choice(words), rand.randint(0, 999))
+        elif kind < 0.5:
+            piece = '\n' + rand.choice(['  * ', '. ', ', ', ') ', '\n\n\n', ': ']) + rand.choice(words)
+        else:
+            piece = ' ' + ' '.join(rand.choice(words) for _ in range(rand.randint(1, 8)))
+        pieces.append(piece)
+        length += len(piece)
+    return ''.join(pieces)[:size]
+
+
+def main():
+    funcs = [('remove_links', remove_links), ('format_md', format_md),
+             ('remove_multi_line_breaks', remove_multi_line_breaks), ('clean_md', clean_md)]
+    print('%-26s %10s %10s %12s' % ('function', 'size', 'seconds', 'MB/s'))
+    for size in [100_000, 1_000_000, 10_000_000]:
+        md = make_markdown(size)
+        for name, func in funcs:
+            start = perf_counter()
+            func(md)
+            elapsed = perf_counter() - start
+            print('%-26s %9dK %10.4f %12.1f' % (name, size // 1000, elapsed, size / 1e6 / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the repository are imported from its root, like main.py and the scripts do
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,48 @@
+"""
+The order and the budget of the webpages visited to answer a question
+"""
+from processing.crawl_frontier import CrawlFrontier
+
+
+def test_pop_by_score_then_push_order():
+    frontier = CrawlFrontier(max_pages=10)
+    frontier.push('https://a.com/1', score=0)
+    frontier.push('https://a.com/2', score=1)
+    frontier.push('https://a.com/3', score=0)
+    assert [frontier.pop()[0] for _ in range(3)] == ['https://a.com/2', 'https://a.com/1', 'https://a.com/3']
+    assert frontier.pop() is None
+
+
+def test_push_skips_seen_too_deep_and_invalid_urls():
+    frontier = CrawlFrontier(max_pages=10, max_depth=1)
+    assert frontier.push('https://a.com/1', score=0)
+    assert not frontier.push('https://a.com/1', score=5)
+    assert not frontier.push('https://a.com/2', score=0, depth=2)
+    assert not frontier.push('http://a.com:port/x', score=0, depth=1)
+    assert len(frontier) == 1
+
+
+def test_budget_is_counted_when_a_page_is_read():
+    frontier = CrawlFrontier(max_pages=3, max_depth=2)
+    for rank in range(5):
+        frontier.push(f'https://a.com/{rank}', score=-rank)
+    # prefetching three search results does not use the budget
+    prefetched = [frontier.pop() for _ in range(3)]
+    assert frontier.remaining() == 3
+    frontier.visit()
+    # a hyperlink found on the first page can still be visited, before the other search results
+    assert frontier.push('https://b.com/link', score=prefetched[0][1] + 1, depth=1)
+    assert frontier.best_score() == 1
+    assert frontier.pop() == ('https://b.com/link', 1, 1)
+    frontier.visit()
+    frontier.visit()
+    assert frontier.remaining() == 0
+    assert frontier.pop() is None
+
+
+def test_requeue_puts_a_popped_url_back():
+    frontier = CrawlFrontier(max_pages=3)
+    frontier.push('https://a.com/1', score=0)
+    url, score, depth = frontier.pop()
+    frontier.requeue(url, score, depth)
+    assert frontier.pop() == ('https://a.com/1', 0, 0)
@@ -0,0 +1,106 @@
+"""
+Stopping early once a chunk answers a question about one thing: is_confident_answer and parallel_until
+"""
+import threading
+import time
+import pytest
+from processing.generate_response import is_confident_answer
+from utils.parallel import parallel_until
+
+
+@pytest.mark.parametrize('answer', [
+    'John Doe is the thesis advisor of Jane Roe.',
+    'It was founded in May 1990.',
+    'The deadline is in May.',
+    '42 dollars',
+])
+def test_confident_answers(answer):
+    assert is_confident_answer(answer)
+
+
+@pytest.mark.parametrize('answer', [
+    '',
+    'None.',
+    'none',
+    'There is not enough information to answer.',
+    'The text does not specify.',
+    "The text doesn't mention the advisor.",
+    'There is no mention of the advisor.',
+    'It is not clear from the text.',
+    'I could not find it',
+    "I couldn't find the advisor.",
+    'The advisor cannot be determined.',
+    'The advisor is not mentioned.',
+    'It may be John Doe.',
+    'It might be John Doe.',
+    'Probably John Doe.',
+    'GPT 3.5/4 error: timeout',
+])
+def test_not_confident_answers(answer):
+    assert not is_confident_answer(answer)
+
+
+def test_parallel_until_without_stop_returns_every_result_in_order():
+    results = parallel_until(lambda x: x * 2, range(20), lambda result: False, max_workers=4)
+    assert results == [x * 2 for x in range(20)]
+
+
+def test_parallel_until_stops_after_the_wave_with_the_answer():
+    consumed = []
+    calls = []
+    lock = threading.Lock()
+
+    def items():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    def func(x):
+        with lock:
+            calls.append(x)
+        return x
+
+    # waves of 2, then 4: the answer (2) is in the second wave
+    results = parallel_until(func, items(), lambda result: result == 2, max_workers=8, first_wave=2)
+    assert 2 in results
+    assert results == sorted(results)
+    assert len(consumed) <= 6
+    assert len(calls) <= 6
+
+
+def test_parallel_until_does_not_wait_for_slow_calls_after_stop():
+    def func(x):
+        if x != 0:
+            time.sleep(1)
+        return x
+
+    start = time.monotonic()
+    results = parallel_until(func, range(10), lambda result: result == 0, max_workers=2, first_wave=2)
+    assert results == [0]
+    assert time.monotonic() - start < 0.5
+
+
+def test_parallel_until_bounds_calls_in_flight():
+    in_flight = [0, 0]
+    lock = threading.Lock()
+
+    def func(x):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return x
+
+    results = parallel_until(func, range(40), lambda result: False, max_workers=3, first_wave=1)
+    assert results == list(range(40))
+    assert in_flight[1] <= 3
+
+
+def test_parallel_until_reports_progress():
+    progress = []
+    parallel_until(lambda x: x, range(5), lambda result: False, max_workers=2,
+                   on_progress=lambda done, total: progress.append((done, total)))
+    assert [done for done, _ in progress] == [1, 2, 3, 4, 5]
+    assert progress[-1][1] == 5
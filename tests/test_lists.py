@@ -0,0 +1,48 @@
+"""
+The "lists" (elements with similar structure) found on saved webpages, and the split of them, must stay the same
+as found by the implementation that compared the tag names of whole subtrees (before subtree signatures).
+The expected results are frozen in tests/expected/lists.json. Only if a change of the lists is intended, freeze
+the new results with: python tests/test_lists.py
+"""
+import glob
+import json
+import os
+import sys
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+PAGES = sorted(glob.glob(os.path.join(TESTS_DIR, 'pages', '*.html')))
+EXPECTED_PATH = os.path.join(TESTS_DIR, 'expected', 'lists.json')
+WINDOW_SIZES = [500, 2000, 6000]
+
+
+def find_lists(path: str) -> dict:
+    from processing.HTMLPreprocessor import HTMLPreprocessor
+    html = open(path, encoding='utf-8').read()
+    preprocessor = HTMLPreprocessor(html, base_url='https://example.com/', use_cache=False)
+    return {
+        'lists': [str(node) for node in preprocessor.lists],
+        'lists_split': {str(w): preprocessor.build_lists_split(window_size=w) for w in WINDOW_SIZES},
+    }
+
+
+@pytest.fixture(scope='module')
+def expected():
+    with open(EXPECTED_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('path', PAGES, ids=os.path.basename)
+def test_same_lists_as_frozen(path, expected):
+    result = find_lists(path)
+    frozen = expected[os.path.basename(path)]
+    assert result['lists'] == frozen['lists']
+    for w in WINDOW_SIZES:
+        assert result['lists_split'][str(w)] == frozen['lists_split'][str(w)]
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(TESTS_DIR, '..'))
+    frozen = {os.path.basename(path): find_lists(path) for path in PAGES}
+    with open(EXPECTED_PATH, 'w', encoding='utf-8') as f:
+        json.dump(frozen, f, indent=1)
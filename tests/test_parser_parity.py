@@ -0,0 +1,49 @@
+"""
+HTMLPreprocessor with parser="lxml" must give the same results as the reference parser="html.parser" on
+the saved webpages. The known differences on broken markup are documented in the `parser` docstring.
+"""
+import glob
+import os
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+PAGES = sorted(glob.glob(os.path.join(TESTS_DIR, 'pages', '*.html')))
+SPLITS = [(2000, 1800), (10000, 8000)]
+LISTS_WINDOW_SIZES = [500, 6000]
+
+
+def preprocess(html: str, parser: str) -> dict:
+    from processing.HTMLPreprocessor import HTMLPreprocessor
+    preprocessor = HTMLPreprocessor(html, base_url='https://example.com/', use_cache=False, parser=parser)
+    result = {
+        'title': preprocessor.title,
+        'hyperlinks': preprocessor.hyperlinks,
+        'markdown': preprocessor.complete_markdown,
+        'header': preprocessor.header['markdown'],
+        'footer': preprocessor.footer['markdown'],
+        'sidebars': [sidebar['markdown'] for sidebar in preprocessor.sidebars],
+        'lists': [preprocessor._markdown(node) for node in preprocessor.lists],
+    }
+    for w, s in SPLITS:
+        result[f'split {w} {s}'] = preprocessor.build_split(window_size=w, stride=s)
+    for w in LISTS_WINDOW_SIZES:
+        result[f'lists split {w}'] = preprocessor.build_lists_split(window_size=w)
+    return result
+
+
+def differing_keys(html: str) -> list:
+    reference = preprocess(html, 'html.parser')
+    result = preprocess(html, 'lxml')
+    return [key for key in reference if reference[key] != result[key]]
+
+
+@pytest.mark.parametrize('path', PAGES, ids=os.path.basename)
+def test_lxml_same_as_html_parser(path):
+    html = open(path, encoding='utf-8').read()
+    assert differing_keys(html) == []
+
+
+@pytest.mark.xfail(strict=True, reason='lxml closes the <p> before the <table>, see the parser docstring')
+def test_table_inside_paragraph():
+    html = '<html><body><p>pre<table><tr><td>a</td><td>b</td></tr></table>post</p></body></html>'
+    assert differing_keys(html) == []
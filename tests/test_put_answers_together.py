@@ -0,0 +1,76 @@
+"""
+Combining the answers from the parts of webpages, with GPT-4 replaced by fakes
+"""
+import re
+import threading
+import time
+import pytest
+import processing.generate_response as generate_response
+from processing.generate_response import put_answers_together
+
+
+def count_parts(prompt):
+    return len(re.findall(r'^part\d+: ', prompt, flags=re.MULTILINE))
+
+
+@pytest.fixture
+def gpt_calls(monkeypatch):
+    """Fake GPT-4: formatting calls return the items of the answers as a list, other calls name the number of answers"""
+    calls = []
+    lock = threading.Lock()
+
+    def fake_chat(system_msg, user_msg, **kwargs):
+        with lock:
+            calls.append(system_msg)
+        time.sleep(0.01)
+        if user_msg.startswith('Write'):
+            answers = system_msg.split(':\n\n', 1)[1].replace('\n______\n', '\n')
+            return '\n'.join('- ' + item.strip() for line in answers.split('\n') for item in line.split(' and '))
+        return 'combined %d answers' % count_parts(system_msg)
+
+    def fake_stream(system_msg, user_msg, **kwargs):
+        calls.append(system_msg)
+        yield 'combined '
+        yield 'answer'
+
+    monkeypatch.setattr(generate_response, 'gpt4_chat', fake_chat)
+    monkeypatch.setattr(generate_response, 'gpt4_chat_stream', fake_stream)
+    return calls
+
+
+def test_empty_answers_are_dropped_without_gpt(gpt_calls):
+    assert put_answers_together('q', ['None.', ' none ', '', None]) == 'None.'
+    assert put_answers_together('q', ['None.']) == 'None.'
+    assert put_answers_together('q', ['None.', 'Alice']) == 'Alice'
+    assert gpt_calls == []
+
+
+def test_count_is_a_number_for_any_number_of_answers(gpt_calls):
+    assert put_answers_together('q', ['Alice'], count_number=True) == 1
+    assert put_answers_together('q', ['Alice and Bob', 'None.'], count_number=True) == 2
+    assert put_answers_together('q', ['None.'], count_number=True) == 0
+    assert put_answers_together('q', [], count_number=True) == 0
+
+
+def test_list_answers_are_merged_and_deduplicated(gpt_calls):
+    answers = ['Alice and Bob', 'None.', 'Bob', 'Carol and Dave', 'Eve', 'Frank', 'Grace']
+    assert put_answers_together('q', answers, answer_is_list=True).split('\n') == \
+        ['Alice', 'Bob', 'Carol', 'Dave', 'Eve', 'Frank', 'Grace']
+    # 6 answers that are not None, in batches of at most FORMAT_BATCH_SIZE
+    assert len(gpt_calls) == 2
+
+
+def test_many_answers_are_reduced_level_by_level(gpt_calls):
+    answers = ['answer %d' % i for i in range(20)]
+    assert put_answers_together('q', answers) == 'combined 3 answers'
+    fan_in = generate_response.PUT_TOGETHER_FAN_IN
+    # 20 answers -> 3 groups of at most 8 -> one last call
+    assert len(gpt_calls) == 4
+    assert all(count_parts(prompt) <= fan_in for prompt in gpt_calls)
+
+
+def test_final_call_is_streamed(gpt_calls):
+    deltas = []
+    assert put_answers_together('q', ['Alice', 'None.', 'Bob'], on_delta=deltas.append) == 'combined answer'
+    assert deltas == ['combined ', 'answer']
+    assert count_parts(gpt_calls[0]) == 2
@@ -0,0 +1,36 @@
+"""
+Splits measured in tokens (model given) must never have a chunk longer than the window, as the window is what is
+left of the context of the model for the chunk.
+"""
+import glob
+import os
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+PAGES = sorted(glob.glob(os.path.join(TESTS_DIR, 'pages', '*.html')))
+MODEL = 'gpt-4'
+
+
+@pytest.fixture(scope='module', params=PAGES, ids=os.path.basename)
+def preprocessor(request):
+    from processing.HTMLPreprocessor import HTMLPreprocessor
+    html = open(request.param, encoding='utf-8').read()
+    return HTMLPreprocessor(html, base_url='https://example.com/', use_cache=False)
+
+
+@pytest.mark.parametrize('window_size', [64, 256, 1024])
+def test_lists_split_within_window(preprocessor, window_size):
+    from utils.tokens import count_tokens
+    split = preprocessor.build_lists_split(window_size=window_size, model=MODEL)
+    assert split
+    for chunk in split:
+        assert count_tokens(chunk, MODEL) <= window_size
+
+
+@pytest.mark.parametrize('window_size, stride', [(128, 100), (512, 400), (2048, 1600)])
+def test_split_within_window(preprocessor, window_size, stride):
+    from utils.tokens import count_tokens
+    split = preprocessor.build_split(window_size=window_size, stride=stride, model=MODEL)
+    assert split
+    for chunk in split:
+        assert count_tokens(chunk, MODEL) <= window_size
@@ -0,0 +1,124 @@
+"""
+A persistent key-value cache on top of SQLite, with age and size based eviction
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from time import time
+from typing import Optional, Union
+
+
+class CacheMissError(Exception):
+    """Raised in replay only mode when a request is not in the cache"""
+
+
+def hash_key(payload) -> str:
+    """
+    Content address of a JSON serializable payload, e.g. model, messages and sampling parameters
+
+    Parameters:
+    payload: anything JSON serializable
+
+    Returns:
+    str: sha256 hex digest
+    """
+    serialized = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class SQLiteCache:
+    """
+    Key-value cache stored in one SQLite file, values are str or bytes.
+    Entries older than max_age seconds are dropped, and when the total size of values exceeds
+    max_size bytes, the least recently used entries are dropped.
+    It is safe to share one instance between threads.
+    """
+
+    def __init__(self, db_file: str, max_size: Optional[int]=None, max_age: Optional[float]=None):
+        self.db_file = db_file
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        folder = os.path.dirname(db_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+
+    def get(self, key: str) -> Optional[Union[str, bytes]]:
+        """
+        Get the value of key, None if there is no such entry or the entry is too old
+        """
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def get_entry(self, key: str):
+        """
+        Get (value, created) of key, None if there is no such entry or the entry is too old
+        """
+        now = time()
+        with self.lock, self.conn:
+            row = self.conn.execute('SELECT value, created FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if self.max_age is not None and row[1] < now - self.max_age:
+                self.conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return None
+            self.conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return row[0], row[1]
+
+    def set(self, key: str, value: Union[str, bytes]) -> None:
+        """
+        Store the value of key, replacing the old one, then evict entries if needed
+        """
+        now = time()
+        size = len(value.encode('utf-8') if isinstance(value, str) else value)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, value, size, now, now)
+            )
+            self._evict(now)
+
+    def touch(self, key: str) -> None:
+        """
+        Mark the entry as created now, e.g. after the source confirmed the entry is still valid
+        """
+        now = time()
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE cache SET created = ?, accessed = ? WHERE key = ?', (now, now, key))
+
+    def delete(self, key: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM cache')
+
+    def _evict(self, now: float) -> None:
+        # must be called with the lock held and inside a transaction
+        if self.max_age is not None:
+            self.conn.execute('DELETE FROM cache WHERE created < ?', (now - self.max_age,))
+        if self.max_size is not None:
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+            if total > self.max_size:
+                # drop least recently used entries until the total size is under max_size
+                to_delete = []
+                for key, size in self.conn.execute('SELECT key, size FROM cache ORDER BY accessed'):
+                    if total <= self.max_size:
+                        break
+                    to_delete.append((key,))
+                    total -= size
+                self.conn.executemany('DELETE FROM cache WHERE key = ?', to_delete)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,46 @@
+"""
+Remove duplicates from a list of texts, including texts contained in other texts
+"""
+from collections import defaultdict
+from typing import Dict, List, Set
+
+
+def remove_contained(texts: List[str], ngram: int=4) -> List[str]:
+    """
+    Remove every text that is contained in another text of the list. Of identical texts only the last one is kept.
+    Same result as checking every pair of texts, but exact duplicates are found by hashing, and for each text
+    only the longer texts sharing its rarest n-gram are checked.
+
+    Parameters:
+    texts (List[str]): the input texts
+    ngram (int): length of n-grams used to find candidate texts that may contain a text
+
+    Returns:
+    List[str]: texts that are kept, in their original order
+    """
+    last_index: Dict[str, int] = {}
+    for i, text in enumerate(texts):
+        last_index[text] = i
+
+    kept: List[str] = []
+    kept_set: Set[str] = set()
+    postings: Dict[str, List[int]] = defaultdict(list)  # n-gram -> ids of kept texts containing it
+    # a text can only be contained in a longer one, so go from the longest to the shortest,
+    # a text contained in a removed text is also contained in the kept text containing that one
+    for text in sorted(last_index, key=len, reverse=True):
+        if len(text) >= ngram:
+            grams = {text[i:i + ngram] for i in range(len(text) - ngram + 1)}
+            # every text containing this text contains all of its n-grams, the rarest gives the fewest candidates
+            rarest = min(grams, key=lambda gram: len(postings.get(gram, ())))
+            contained = any(text in kept[k] for k in postings.get(rarest, ()))
+        else:
+            grams = set()
+            contained = any(text in other for other in kept)
+        if contained:
+            continue
+        for gram in grams:
+            postings[gram].append(len(kept))
+        kept.append(text)
+        kept_set.add(text)
+
+    return [text for i, text in enumerate(texts) if last_index[text] == i and text in kept_set]
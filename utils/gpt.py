@@ -1,22 +1,158 @@
 import openai
+import json
 import os
 import re
+import threading
 from time import time, sleep
+from typing import Iterator, List, Optional
+import numpy as np
 from .file_io import save_file 
+from .cache import SQLiteCache, CacheMissError, hash_key
+
+_cache: Optional[SQLiteCache] = None
+_cache_mode: Optional[str] = None
+_cache_lock = threading.RLock()
+
+
+def configure_gpt_cache(mode: Optional[str]=None, db_file: Optional[str]=None, max_size: Optional[int]=None, max_age: Optional[float]=None) -> None:
+    """
+    Configure the on-disk cache of OpenAI responses. Only deterministic requests (temp=0 and embeddings) are cached.
+    Every argument left as None is read from the environment.
+
+    Parameters:
+    mode (str): "on" to read and write the cache, "off" to disable it, "replay" to only read the cache and
+        raise CacheMissError instead of calling the API (env GPT_CACHE, default "on")
+    db_file (str): path to the SQLite file (env GPT_CACHE_FILE, default "gpt_cache/cache.sqlite3")
+    max_size (int): maximum total size of cached responses in bytes (env GPT_CACHE_MAX_SIZE_MB, default 512 MB)
+    max_age (float): maximum age of a cached response in seconds (env GPT_CACHE_MAX_AGE_DAYS, default 30 days)
+    """
+    global _cache, _cache_mode
+    mode = mode or os.getenv('GPT_CACHE', 'on').lower()
+    if mode not in ('on', 'off', 'replay'):
+        raise ValueError(f'GPT cache mode should be "on", "off" or "replay", got "{mode}"')
+    db_file = db_file or os.getenv('GPT_CACHE_FILE', os.path.join('gpt_cache', 'cache.sqlite3'))
+    if max_size is None:
+        max_size = int(float(os.getenv('GPT_CACHE_MAX_SIZE_MB', 512)) * 1024 * 1024)
+    if max_age is None:
+        max_age = float(os.getenv('GPT_CACHE_MAX_AGE_DAYS', 30)) * 24 * 3600
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = SQLiteCache(db_file, max_size=max_size, max_age=max_age) if mode != 'off' else None
+        _cache_mode = mode
+
+
+def _cache_lookup(request: dict, deterministic: bool):
+    """
+    Look up a request in the cache
+
+    Returns:
+    (str or None, str or None): key to store the response under (None if it should not be cached), and the cached response
+    """
+    if _cache_mode is None:
+        with _cache_lock:
+            if _cache_mode is None:
+                configure_gpt_cache()
+    if _cache_mode == 'off':
+        return None, None
+    if not deterministic:
+        if _cache_mode == 'replay':
+            raise CacheMissError('Only deterministic requests (temp=0) can be replayed from the GPT cache')
+        return None, None
+    key = hash_key(request)
+    cached = _cache.get(key)
+    if cached is None and _cache_mode == 'replay':
+        raise CacheMissError(f'Request to {request.get("model")} is not in the GPT cache')
+    return key, cached
+
+
+def _cache_store(key: Optional[str], response: str) -> None:
+    if key is not None and _cache_mode == 'on':
+        _cache.set(key, response)
+
 
 def gpt3_embedding(content, engine='text-embedding-ada-002'):
     content = content.encode(encoding='ASCII',errors='ignore').decode()  # fix any UNICODE errors
+    cache_key, cached = _cache_lookup({'api': 'embedding', 'model': engine, 'input': content}, deterministic=True)
+    if cached is not None:
+        return json.loads(cached)
     response = openai.Embedding.create(input=content,engine=engine)
     vector = response['data'][0]['embedding']  # this is a normal list
+    _cache_store(cache_key, json.dumps(vector))
     return vector
 
 
+def gpt3_embeddings(contents: List[str], engine='text-embedding-ada-002', batch_size: int=500, max_batch_chars: int=200000) -> np.ndarray:
+    """
+    Embed many texts with as few requests as possible. Identical texts are embedded once, texts already
+    in the cache are not sent, and the rest are sent in batches.
+
+    Parameters:
+    contents (List[str]): texts to embed
+    engine (str): embedding model
+    batch_size (int): maximum number of texts in one request
+    max_batch_chars (int): maximum total number of characters in one request
+
+    Returns:
+    np.ndarray: float32 matrix, row i is the embedding of contents[i]
+    """
+    max_retry = 5
+    contents = [content.encode(encoding='ASCII',errors='ignore').decode() for content in contents]
+    unique = list(dict.fromkeys(contents))
+    vectors = dict()
+    cache_keys = dict()
+    for content in unique:
+        cache_key, cached = _cache_lookup({'api': 'embedding', 'model': engine, 'input': content}, deterministic=True)
+        if cached is not None:
+            vectors[content] = json.loads(cached)
+        else:
+            cache_keys[content] = cache_key
+
+    # group the texts that are not cached to request sized batches
+    batches: List[List[str]] = []
+    batch_chars = 0
+    for content in cache_keys:
+        if batches and len(batches[-1]) < batch_size and batch_chars + len(content) <= max_batch_chars:
+            batches[-1].append(content)
+            batch_chars += len(content)
+        else:
+            batches.append([content])
+            batch_chars = len(content)
+
+    for batch in batches:
+        retry = 0
+        while True:
+            try:
+                response = openai.Embedding.create(input=batch, engine=engine)
+                break
+            except Exception as oops:
+                retry += 1
+                if retry >= max_retry:
+                    raise
+                print('Error communicating with OpenAI:', oops)
+                sleep(1)
+        for item in response['data']:
+            content = batch[item['index']]
+            vectors[content] = item['embedding']
+            _cache_store(cache_keys[content], json.dumps(item['embedding']))
+
+    if len(contents) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray([vectors[content] for content in contents], dtype=np.float32)
+
+
 
 def gpt3_completion(prompt, engine='text-davinci-003', temp=0.0, top_p=1.0, tokens=512, freq_pen=0.0, pres_pen=0.0, stop=['USER:', 'ISAAC:'], log=False):
     max_retry = 5
     retry = 0
     prompt = prompt.encode(encoding='ASCII',errors='ignore').decode()
     prompt = prompt.strip()
+    cache_key, cached = _cache_lookup({
+        'api': 'completion', 'model': engine, 'prompt': prompt, 'max_tokens': tokens, 'top_p': top_p,
+        'frequency_penalty': freq_pen, 'presence_penalty': pres_pen, 'stop': stop
+    }, deterministic=(temp == 0))
+    if cached is not None:
+        return cached
     while True:
         try:
             response = openai.Completion.create(
@@ -36,6 +172,7 @@ def gpt3_completion(prompt, engine='text-davinci-003', temp=0.0, top_p=1.0, toke
                 os.makedirs('gpt3_logs')
             if log:
                 save_file('gpt3_logs/%s' % filename, prompt + '\n\n==========\n\n' + text)
+            _cache_store(cache_key, text)
             return text
         except Exception as oops:
             retry += 1
@@ -51,6 +188,12 @@ def gpt_chat(system_msg: str, user_msg: str, model="gpt-3.5-turbo", temp=0.0, to
     user_msg = user_msg.encode(encoding='ASCII',errors='ignore').decode()
     system_msg = system_msg.strip()
     user_msg = user_msg.strip()
+    cache_key, cached = _cache_lookup({
+        'api': 'chat', 'model': model, 'messages': [system_msg, user_msg], 'max_tokens': tokens, 'top_p': top_p,
+        'frequency_penalty': freq_pen, 'presence_penalty': pres_pen
+    }, deterministic=(temp == 0))
+    if cached is not None:
+        return cached
     while True:
         try:
             completion = openai.ChatCompletion.create(
@@ -74,6 +217,7 @@ def gpt_chat(system_msg: str, user_msg: str, model="gpt-3.5-turbo", temp=0.0, to
                 os.makedirs('gpt_logs')
             if log:
                 save_file('gpt_logs/%s' % filename, system_msg + '\n\n==========\n\n' + user_msg + '\n\n==========\n\n' + text)
+            _cache_store(cache_key, text)
             return text
         except Exception as oops:
             retry += 1
@@ -88,4 +232,113 @@ def gpt3_chat(system_msg: str, user_msg: str, model="gpt-3.5-turbo", temp=0.0, t
 
 
 def gpt4_chat(system_msg: str, user_msg: str, model="gpt-4", temp=0.0, top_p=1.0, tokens=1024, freq_pen=0.0, pres_pen=0.0, log=False):
-    return gpt_chat(system_msg, user_msg, model, temp, top_p, tokens, freq_pen, pres_pen, log)
\ No newline at end of file
+    return gpt_chat(system_msg, user_msg, model, temp, top_p, tokens, freq_pen, pres_pen, log)
+
+
+class WhitespaceNormalizer:
+    """
+    The whitespace normalization of gpt_chat (strip, then collapse line breaks and spaces), applied to a text
+    that arrives in pieces. Whitespace at the end of what arrived so far is held back until the next
+    non-whitespace character, so a run of whitespace is never split between two pieces and the
+    concatenation of the outputs is exactly the normalized text.
+    """
+
+    def __init__(self):
+        self.pending = ''
+        self.started = False
+
+    def feed(self, delta: str) -> str:
+        text = self.pending + delta
+        stripped = text.rstrip()
+        if stripped == '':
+            # only whitespace so far, drop it at the beginning of the text
+            self.pending = text if self.started else ''
+            return ''
+        self.pending = text[len(stripped):]
+        if not self.started:
+            stripped = stripped.lstrip()
+            self.started = True
+        stripped = re.sub('[\r\n]+', '\n', stripped)
+        return re.sub('[\t ]+', ' ', stripped)
+
+
+def gpt_chat_stream(system_msg: str, user_msg: str, model="gpt-3.5-turbo", temp=0.0, top_p=1.0, tokens=1024, freq_pen=0.0, pres_pen=0.0, log=False) -> Iterator[str]:
+    """
+    Same as gpt_chat, but yields the answer in pieces as they are generated, with the same whitespace normalization.
+    The caller can stop reading at any time (break, or close()). The rest of a cacheable answer is then read in the
+    background and cached, so the next identical request is answered from the cache.
+    """
+    max_retry = 5
+    retry = 0
+    system_msg = system_msg.encode(encoding='ASCII',errors='ignore').decode()
+    user_msg = user_msg.encode(encoding='ASCII',errors='ignore').decode()
+    system_msg = system_msg.strip()
+    user_msg = user_msg.strip()
+    cache_key, cached = _cache_lookup({
+        'api': 'chat', 'model': model, 'messages': [system_msg, user_msg], 'max_tokens': tokens, 'top_p': top_p,
+        'frequency_penalty': freq_pen, 'presence_penalty': pres_pen
+    }, deterministic=(temp == 0))
+    if cached is not None:
+        yield cached
+        return
+
+    def save(text: str) -> None:
+        filename = '%s_gpt.txt' % time()
+        if not os.path.exists('gpt_logs'):
+            os.makedirs('gpt_logs')
+        if log:
+            save_file('gpt_logs/%s' % filename, system_msg + '\n\n==========\n\n' + user_msg + '\n\n==========\n\n' + text)
+        _cache_store(cache_key, text)
+
+    def drain(chunks, normalizer: WhitespaceNormalizer, pieces: List[str]) -> None:
+        try:
+            for chunk in chunks:
+                pieces.append(normalizer.feed(chunk['choices'][0]['delta'].get('content') or ''))
+            save(''.join(pieces))
+        except Exception as oops:  # pylint: disable=broad-except
+            print('Error communicating with OpenAI:', oops)
+
+    while True:
+        normalizer = WhitespaceNormalizer()
+        pieces: List[str] = []
+        try:
+            chunks = iter(openai.ChatCompletion.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_msg},
+                    {"role": "user", "content": user_msg}
+                ],
+                temperature=temp,
+                max_tokens=tokens,
+                top_p=top_p,
+                frequency_penalty=freq_pen,
+                presence_penalty=pres_pen,
+                stream=True
+            ))
+            for chunk in chunks:
+                piece = normalizer.feed(chunk['choices'][0]['delta'].get('content') or '')
+                pieces.append(piece)
+                if piece:
+                    yield piece
+            save(''.join(pieces))
+            return
+        except GeneratorExit:
+            # the caller stopped reading
+            if cache_key is not None and _cache_mode == 'on':
+                threading.Thread(target=drain, args=(chunks, normalizer, pieces), daemon=True).start()
+            raise
+        except Exception as oops:
+            if any(pieces):
+                # part of the answer is already given to the caller, it can't be taken back
+                print('Error communicating with OpenAI:', oops)
+                return
+            retry += 1
+            if retry >= max_retry:
+                yield "GPT 3.5/4 error: %s" % oops
+                return
+            print('Error communicating with OpenAI:', oops)
+            sleep(1)
+
+
+def gpt4_chat_stream(system_msg: str, user_msg: str, model="gpt-4", temp=0.0, top_p=1.0, tokens=1024, freq_pen=0.0, pres_pen=0.0, log=False) -> Iterator[str]:
+    return gpt_chat_stream(system_msg, user_msg, model, temp, top_p, tokens, freq_pen, pres_pen, log)
@@ -0,0 +1,141 @@
+"""
+Grammar correction with one long-lived LanguageTool server shared by all the questions
+"""
+import atexit
+import copy
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# separates the texts of a batch, so each text is checked as its own paragraph
+_BATCH_SEPARATOR = "\n\n"
+
+
+def is_bad_rule(rule) -> bool:
+    """
+    Spelling "mistakes" whose first suggestion is capitalized are usually names, they are not corrected
+    """
+    return rule.message == 'Possible spelling mistake found.' and len(rule.replacements) and rule.replacements[0][0].isupper()
+
+
+class GrammarChecker:
+    """
+    LanguageTool started lazily on a background thread and reused for every check.
+    All the calls to LanguageTool run on that one thread. A check that takes longer than timeout seconds,
+    or any error (e.g. Java is not installed), returns the texts unchanged instead of blocking.
+    """
+
+    def __init__(self, language: str='en-US', timeout: float=10, enabled: bool=True):
+        self.language = language
+        self.timeout = timeout
+        self.enabled = enabled
+        self.tool = None
+        self.failed = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='language-tool')
+
+    def _start(self) -> None:
+        if self.tool is not None or self.failed:
+            return
+        try:
+            import language_tool_python
+            self.tool = language_tool_python.LanguageTool(self.language)
+        except Exception as err:  # pylint: disable=broad-except
+            self.failed = True
+            logger.error("LanguageTool could not start, questions will not be corrected: %s", err)
+
+    def warm_up(self) -> Optional[Future]:
+        """
+        Start LanguageTool in the background, so the first question does not wait for it
+        """
+        if not self.enabled:
+            return None
+        return self.executor.submit(self._warm_up)
+
+    def _warm_up(self) -> None:
+        self._start()
+        if self.tool is not None:
+            # the first check loads the rules
+            self.tool.check('This is a warm up.')
+
+    def correct(self, text: str) -> str:
+        return self.correct_batch([text])[0]
+
+    def correct_batch(self, texts: List[str]) -> List[str]:
+        """
+        Correct several texts with one LanguageTool check
+
+        Parameters:
+        texts (List[str]): the texts to correct
+
+        Returns:
+        List[str]: the corrected texts, the texts themselves if LanguageTool is not available or too slow
+        """
+        if not self.enabled or self.failed or len(texts) == 0:
+            return list(texts)
+        future = self.executor.submit(self._correct_batch, list(texts))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            logger.warning("Grammar check took longer than %s seconds, the texts are not corrected", self.timeout)
+            future.cancel()
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Error checking grammar: %s", err)
+        return list(texts)
+
+    def _correct_batch(self, texts: List[str]) -> List[str]:
+        self._start()
+        if self.tool is None:
+            return texts
+        import language_tool_python
+        matches = [rule for rule in self.tool.check(_BATCH_SEPARATOR.join(texts)) if not is_bad_rule(rule)]
+        # give every match to the text it is in, with the offset in that text
+        text_matches = [[] for _ in texts]
+        start = 0
+        i = 0
+        for match in sorted(matches, key=lambda match: match.offset):
+            while i < len(texts) and match.offset >= start + len(texts[i]):
+                start += len(texts[i]) + len(_BATCH_SEPARATOR)
+                i += 1
+            if i == len(texts) or match.offset < start or match.offset + match.errorLength > start + len(texts[i]):
+                # in or across a separator
+                continue
+            match = copy.copy(match)
+            match.offset -= start
+            text_matches[i].append(match)
+        return [language_tool_python.utils.correct(text, matches) for text, matches in zip(texts, text_matches)]
+
+    def close(self) -> None:
+        """
+        Stop the LanguageTool server
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.tool is not None:
+            try:
+                self.tool.close()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.debug("Error closing LanguageTool: %s", err)
+            self.tool = None
+
+
+_checker: Optional[GrammarChecker] = None
+_checker_lock = threading.Lock()
+
+
+def get_grammar_checker() -> GrammarChecker:
+    """
+    The process-wide grammar checker, configured from the environment on first use and closed at exit.
+    GRAMMAR_CHECK ("on" or "off", default "on"), GRAMMAR_CHECK_TIMEOUT (seconds, default 10)
+    """
+    global _checker
+    with _checker_lock:
+        if _checker is None:
+            _checker = GrammarChecker(
+                timeout=float(os.getenv("GRAMMAR_CHECK_TIMEOUT", 10)),
+                enabled=os.getenv("GRAMMAR_CHECK", "on").lower() != "off",
+            )
+            atexit.register(_checker.close)
+        return _checker
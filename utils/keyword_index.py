@@ -0,0 +1,99 @@
+"""
+A local BM25 inverted index over chunks of a webpage, used to pick chunks worth sending to GPT-4
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text to lowercase words, plural words are roughly converted to singular form
+    """
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 scoring, documents are identified by their position in the list
+    """
+
+    def __init__(self, docs: List[str], k1: float=1.5, b: float=0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(docs)
+        self.doc_lens: List[int] = []
+        self.postings: Dict[str, List[tuple]] = defaultdict(list)  # term -> [(doc id, term frequency)]
+        for doc_id, doc in enumerate(docs):
+            tokens = tokenize(doc)
+            self.doc_lens.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                self.postings[term].append((doc_id, freq))
+        self.avg_doc_len = (sum(self.doc_lens) / self.num_docs) if self.num_docs else 0
+
+    def scores(self, query: str) -> List[float]:
+        """
+        BM25 score of every document for the query, 0 if a document contains none of the query terms
+        """
+        scores = [0.0] * self.num_docs
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (self.num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_id] / max(self.avg_doc_len, 1))
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return scores
+
+
+def preselect_chunks(chunks: Iterable[str], keyword: Optional[str], keep_ratio: float=0.1, neighbors: int=1, min_chunks: int=3) -> Iterable[str]:
+    """
+    Keep only the chunks that best match the keyword, plus their neighbors
+
+    Parameters:
+    chunks (Iterable[str]): the split of a webpage
+    keyword (str or None): keyword of the question, if None all the chunks are kept (and chunks is returned as is)
+    keep_ratio (float): fraction of chunks to keep, the recall/cost knob. With keep_ratio >= 1 every chunk
+        containing the keyword is kept, with keep_ratio <= 0 nothing is filtered
+    neighbors (int): number of chunks kept before and after each selected chunk
+    min_chunks (int): keep at least this many of the best matching chunks
+
+    Returns:
+    Iterable[str]: the selected chunks, in their original order
+    """
+    if not keyword or keep_ratio <= 0:
+        return chunks
+    chunks = list(chunks)
+    if len(chunks) <= min_chunks:
+        return chunks
+    scores = BM25Index(chunks).scores(keyword)
+    matched = [i for i in sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True) if scores[i] > 0]
+    if len(matched) == 0:
+        # the keyword is not on this webpage in the same words, better not to guess
+        return chunks
+    num_keep = max(min_chunks, math.ceil(keep_ratio * len(chunks)))
+    selected = set()
+    for i in matched[:num_keep]:
+        selected.update(range(max(0, i - neighbors), min(len(chunks), i + neighbors + 1)))
+    return [chunk for i, chunk in enumerate(chunks) if i in selected]
+
+
+def order_chunks(chunks: Iterable[str], query: Optional[str]) -> List[str]:
+    """
+    Sort chunks from the most to the least relevant to the query by BM25, chunks with the same score stay in
+    their original order, so without a query (or without any match) the order does not change
+    """
+    chunks = list(chunks)
+    if not query or len(chunks) <= 1:
+        return chunks
+    scores = BM25Index(chunks).scores(query)
+    return [chunks[i] for i in sorted(range(len(chunks)), key=lambda i: -scores[i])]
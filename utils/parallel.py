@@ -0,0 +1,115 @@
+"""
+Run many independent (mostly GPT) calls at the same time with a bounded number in flight
+"""
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Iterable, List, Optional
+
+
+def parallel_map(
+    func: Callable,
+    items: Iterable,
+    max_workers: int=8,
+    on_progress: Optional[Callable[[int, Optional[int]], None]]=None
+) -> List:
+    """
+    Apply func to every item concurrently, with at most max_workers calls in flight.
+    Items are consumed lazily, so a generator can keep producing while earlier items are processed.
+
+    Parameters:
+    func (Callable): function called with one item
+    items (Iterable): the inputs
+    max_workers (int): maximum number of calls in flight at the same time
+    on_progress (Callable or None): called as on_progress(done, total) every time a call finishes,
+        total is None until all the items have been consumed
+
+    Returns:
+    List: results of func, in the same order as items
+    """
+    max_workers = max(1, max_workers)
+    results = dict()
+    iterator = iter(items)
+    total = None
+    done = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = dict()
+        submitted = 0
+        while True:
+            # keep at most max_workers calls in flight
+            while total is None and len(in_flight) < max_workers:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    total = submitted
+                    break
+                in_flight[executor.submit(func, item)] = submitted
+                submitted += 1
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results[in_flight.pop(future)] = future.result()
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+    return [results[i] for i in range(len(results))]
+
+
+def parallel_until(
+    func: Callable,
+    items: Iterable,
+    stop: Callable[[Any], bool],
+    max_workers: int=8,
+    first_wave: int=2,
+    on_progress: Optional[Callable[[int, Optional[int]], None]]=None
+) -> List:
+    """
+    Apply func to the items in waves until a result is good enough, so put the most promising items first.
+    The first wave has first_wave calls, every next wave twice as many, up to max_workers. As soon as stop(result)
+    is True, no new call is started and the calls of the wave that are still running are not waited for.
+
+    Parameters:
+    func (Callable): function called with one item
+    items (Iterable): the inputs, consumed lazily
+    stop (Callable): called with every result, True to stop
+    max_workers (int): maximum number of calls in flight at the same time
+    first_wave (int): number of calls in the first wave
+    on_progress (Callable or None): called as on_progress(done, total) every time a call finishes,
+        total is None until all the items have been consumed
+
+    Returns:
+    List: results of the calls that finished, in the same order as items
+    """
+    max_workers = max(1, max_workers)
+    wave_size = max(1, min(first_wave, max_workers))
+    results = dict()
+    iterator = iter(items)
+    submitted = 0
+    total = None
+    done = 0
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while total is None:
+            wave = dict()
+            for item in itertools.islice(iterator, wave_size):
+                wave[executor.submit(func, item)] = submitted
+                submitted += 1
+            if len(wave) < wave_size:
+                total = submitted
+            stopped = False
+            pending = set(wave)
+            while pending and not stopped:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results[wave[future]] = future.result()
+                    done += 1
+                    if on_progress:
+                        on_progress(done, total)
+                    stopped = stopped or stop(results[wave[future]])
+            if stopped:
+                break
+            wave_size = min(wave_size * 2, max_workers)
+    finally:
+        # calls that did not start are cancelled, running calls finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [results[i] for i in sorted(results)]
@@ -1,5 +1,12 @@
 import re
 
+# "](" starts the url of a link, everything until the next ")" (or the end of the doc) is the url
+_LINK_URL = re.compile(r'\]\([^)]*\)?')
+# special characters at the beginning of a line, and the spaces after each of them
+_LEADING_SPECIALS = re.compile(r'(?:[\]\)>,.;:]\s*)+')
+_SPECIALS = re.compile(r'[\]\)>,.;:]')
+_MULTI_LINE_BREAKS = re.compile(r'(\n\s*){3,}')
+
 def remove_links(md: str):
     """
     Remove all the links on the markdown document
@@ -10,19 +17,7 @@ def remove_links(md: str):
     Returns:
     str: processed markdown
     """
-    to_return = ""
-    is_link = False
-    for i in range(len(md)):
-        if is_link and md[i] == ')':
-            is_link = False
-            continue
-        if is_link:
-            continue
-        if md[i] == ']' and i + 1 < len(md) and md[i+1] == '(':
-            is_link = True
-        to_return += md[i]
-    
-    return to_return
+    return _LINK_URL.sub(']', md)
 
 def format_md(md: str):
     """
@@ -36,12 +31,13 @@ def format_md(md: str):
     """
     lines = md.split('\n')
     for i in range(1, len(lines)):
-        lines[i] = lines[i].strip()
-        specials = [']', ')', '>', ',', '.', ';', ':']
-        while len(lines[i]) > 0 and lines[i][0] in specials:
-            lines[i-1] += ' ' + lines[i][0]
-            lines[i] = lines[i][1:]
-            lines[i] = lines[i].strip()
+        line = lines[i].strip()
+        # move the special characters at the beginning of this line to the end of the previous line
+        match = _LEADING_SPECIALS.match(line)
+        if match:
+            lines[i-1] += ''.join(' ' + special for special in _SPECIALS.findall(match.group()))
+            line = line[match.end():]
+        lines[i] = line
     return '\n'.join(lines)
 
 def remove_multi_line_breaks(md: str):
@@ -54,4 +50,17 @@ def remove_multi_line_breaks(md: str):
     Returns:
     str: processed markdown
     """
-    return re.sub(r'(\n\s*){3,}', '\n\n', md)
\ No newline at end of file
+    return _MULTI_LINE_BREAKS.sub('\n\n', md)
+
+def clean_md(md: str):
+    """
+    Remove links, move special characters at the beginning of lines and remove consecutive line breaks,
+    same as applying remove_links, format_md and remove_multi_line_breaks in this order, in linear time
+
+    Parameters:
+    md (str): the input markdown doc
+    
+    Returns:
+    str: processed markdown
+    """
+    return remove_multi_line_breaks(format_md(remove_links(md)))
@@ -1,4 +1,5 @@
-from typing import Union
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
 
 def split_text_by_char_len(input: str, window_size: int=6000, stride: Union[int, None]=3000):
     """
@@ -38,3 +39,77 @@ def split_text_by_char_len(input: str, window_size: int=6000, stride: Union[int,
         result.append(input[start:len(input)])
     return result
 
+
+def pack_pieces(pieces: Iterable[Tuple[str, int]], window_size: int, stride: int) -> Iterator[str]:
+    """
+    Pack consecutive pieces of a document to chunks of at most window_size, a piece longer than window_size
+    is a chunk by itself. A new chunk starts every "stride", so chunks overlap if stride < window_size.
+    Each chunk is yielded as soon as it is complete.
+
+    Parameters:
+    pieces (Iterable[Tuple[str, int]]): the pieces in document order, each with its length
+    window_size (int): maximum length of a chunk
+    stride (int): distance between the starts of two chunks
+
+    Returns:
+    Iterator[str]: the chunks
+    """
+    # A chunk is complete once the next piece doesn't fit. An open chunk contains every piece since its start,
+    # so older chunks are always longer and complete first. Only the open chunks are kept, as
+    # (index of the first piece, total length of pieces before it).
+    texts: List[str] = []  # pieces since the start of the oldest open chunk
+    first_piece = 0  # index of texts[0]
+    total_len = 0
+    open_windows = deque([(0, 0)])
+    stride_len = 0
+    for piece_index, (piece, piece_len) in enumerate(pieces):
+        while open_windows and total_len - open_windows[0][1] + piece_len > window_size:
+            start = open_windows.popleft()[0]
+            yield "".join(texts[start - first_piece:])
+            next_start = open_windows[0][0] if open_windows else piece_index
+            del texts[:next_start - first_piece]
+            first_piece = next_start
+        texts.append(piece)
+        if stride_len + piece_len <= stride:
+            stride_len += piece_len
+        else:
+            open_windows.append((piece_index, total_len))
+            stride_len = piece_len
+        total_len += piece_len
+
+    for start, _ in open_windows:
+        yield "".join(texts[start - first_piece:])
+
+
+def split_text_by_length(input: str, window_size: int, stride: Optional[int]=None, length: Callable[[str], int]=len) -> List[str]:
+    """
+    Split the text to chunks of at most window_size measured by the length function, e.g. number of tokens.
+    Like split_text_by_char_len, chunks only end at line breaks, a line longer than window_size is cut to
+    parts of about window_size.
+
+    Parameters:
+    input (str): the input document to be split
+    window_size (int): maximum length of each chunk
+    stride (int or None): distance between the starts of two chunks, None for chunks without overlap
+    length (Callable[[str], int]): length of a text, e.g. utils.tokens.token_counter(model)
+
+    Returns:
+    List[str]: the split
+    """
+    pieces = []
+    for line in input.splitlines(keepends=True):
+        line_len = length(line)
+        if line_len <= window_size:
+            pieces.append((line, line_len))
+            continue
+        step = max(1, len(line) * window_size // line_len)
+        start = 0
+        while start < len(line):
+            part = line[start:start + step]
+            part_len = length(part)
+            while part_len > window_size and len(part) > 1:
+                part = part[:len(part) * window_size // part_len or 1]
+                part_len = length(part)
+            pieces.append((part, part_len))
+            start += len(part)
+    return list(pack_pieces(pieces, window_size, stride or window_size))
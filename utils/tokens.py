@@ -0,0 +1,110 @@
+"""
+Count tokens of texts for OpenAI chat models, to fill prompts up to the context size of a model.
+tiktoken is used if it is installed and its encodings can be loaded, else the number of tokens is estimated offline.
+"""
+import functools
+import logging
+import re
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# context size of the models, in tokens, a model not listed here uses the longest listed prefix of its name
+MODEL_CONTEXT_TOKENS = {
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-3.5-turbo': 4096,
+    'gpt-3.5-turbo-16k': 16384,
+    'text-davinci-003': 4097,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+
+# tokens added by the chat format to every message, and to prime the reply
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+
+# The estimate follows how the cl100k tokenizer splits text: an English word (with the space before it) is one token
+# up to about 6 letters, numbers are split to groups of 3 digits, line breaks and runs of spaces are one token,
+# punctuation and other characters about one token each, and CJK characters about 1.5 tokens each.
+# It rather over-estimates, so a prompt filled by the estimate still fits in the context.
+_TOKEN = re.compile(r'[A-Za-z]{1,6}|\d{1,3}|[^\S ]\s*| {2,}|[^\sA-Za-z\d]')
+_CJK = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+# share of the budget kept free when the tokens are only estimated
+_ESTIMATE_MARGIN = 0.05
+
+
+def context_size(model: str) -> int:
+    """
+    Number of tokens in the context of the model, the prompt and the reply together
+    """
+    prefixes = [name for name in MODEL_CONTEXT_TOKENS if model.startswith(name)]
+    if not prefixes:
+        return DEFAULT_CONTEXT_TOKENS
+    return MODEL_CONTEXT_TOKENS[max(prefixes, key=len)]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of text without a tokenizer
+    """
+    cjk = len(_CJK.findall(text))
+    return len(_TOKEN.findall(text)) + (cjk + 1) // 2
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as err:  # pylint: disable=broad-except
+        # not installed, unknown model, or the encoding can't be downloaded
+        logger.info("tiktoken is not available for %s, the number of tokens is estimated: %s", model, err)
+        return None
+
+
+def count_tokens(text: str, model: str='gpt-4') -> int:
+    """
+    Number of tokens of text for the model, estimated if tiktoken is not available
+
+    Parameters:
+    text (str): the text
+    model (str): the model the text is sent to
+
+    Returns:
+    int: number of tokens
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def token_counter(model: Optional[str]) -> Callable[[str], int]:
+    """
+    The function measuring the length of a text: number of tokens for the model, or number of characters if model is None
+    """
+    if model is None:
+        return len
+    return functools.partial(count_tokens, model=model)
+
+
+def chunk_token_budget(model: str, *messages: str, reply_tokens: int=1024, round_to: int=256) -> int:
+    """
+    Number of tokens left for a chunk of a webpage in a chat prompt: the context of the model minus the
+    rest of the messages (e.g. the prompt template without the chunk, the question), the chat format and the reply
+
+    Parameters:
+    model (str): the model the prompt is sent to
+    messages (str): the text of the messages except the chunk
+    reply_tokens (int): maximum number of tokens of the reply (max_tokens of the request)
+    round_to (int): the budget is rounded down to a multiple of round_to, so a webpage is split the same way
+        for prompts of slightly different lengths, and the split can be reused from the cache
+
+    Returns:
+    int: number of tokens for the chunk, at least round_to
+    """
+    budget = context_size(model) - reply_tokens - _TOKENS_PER_REPLY
+    budget -= sum(count_tokens(message, model) + _TOKENS_PER_MESSAGE for message in messages)
+    if _get_encoding(model) is None:
+        budget -= int(context_size(model) * _ESTIMATE_MARGIN)
+    return max(round_to, budget // round_to * round_to)
@@ -1,50 +1,102 @@
 """
-Implementation of a vector database, not used in the final version
+Implementation of a vector database, not used in the final version.
+Vectors are stored as a float32 matrix with normalized rows in "<vdb_file>.vectors" (memory mapped when queried),
+and everything else of an entry (e.g. content) is stored as one JSON line per entry in vdb_file.
 """
-from .similarity import cosine_similarity
 import json
 import os
+from typing import Dict, List, Union
+import numpy as np
+
 
 class VDB:
-    def __init__(self, vdb_file: str):
+    def __init__(self, vdb_file: str, overwrite: bool=True):
+        """
+        Parameters:
+        vdb_file (str): path to the metadata file, vectors are stored next to it
+        overwrite (bool): start with an empty database, else keep what is already in the files
+        """
         self.vdb_file = vdb_file
-        with open(vdb_file, 'w') as f:
-            json.dump([], f)
+        self.vectors_file = vdb_file + '.vectors'
+        self.metadata: List[Dict] = []
+        self.dim: int = None
+        self._matrix = None
+        if overwrite or not os.path.exists(vdb_file) or not os.path.exists(self.vectors_file):
+            self.empty_db()
+        else:
+            with open(vdb_file, 'r', encoding='utf-8') as infile:
+                self.metadata = [json.loads(line) for line in infile if line.strip()]
+            if len(self.metadata) > 0:
+                self.dim = os.path.getsize(self.vectors_file) // (4 * len(self.metadata))
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def _get_matrix(self) -> np.ndarray:
+        # memory map the vectors, only done again after new vectors are inserted
+        if self._matrix is None:
+            self._matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(len(self.metadata), self.dim))
+        return self._matrix
 
     # query the most similar vectors from the vector database
-    def query_index(self, vector, count: int=15):
-        with open(self.vdb_file, 'r') as infile:
-            data = json.load(infile)
-        
-        scores = list()
-        for i in data:
-            score = cosine_similarity(vector, i['vector'])
-            #print(score)
-            scores.append({'content': i['content'], 'score': score})
-        ordered = sorted(scores, key=lambda d: d['score'], reverse=True)
-        ordered_content = [x['content'] for x in ordered]
-        return scores
+    def query_index(self, vector, count: int=15) -> List[Dict]:
+        """
+        Find the entries with the highest cosine similarity to vector
+
+        Returns:
+        List[Dict]: at most count entries, each is the inserted entry without vector plus its "score", most similar first
+        """
+        return self.query_batch([vector], count)[0]
+
+    def query_batch(self, vectors, count: int=15) -> List[List[Dict]]:
+        """
+        Same as query_index, but for many query vectors at once with a single matrix product
+        """
+        if len(self.metadata) == 0:
+            return [[] for _ in vectors]
+        queries = np.asarray(vectors, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ self._get_matrix().T
+        count = min(count, len(self.metadata))
+
+        results = []
+        for row in scores:
+            if count < len(row):
+                top = np.argpartition(-row, count - 1)[:count]
+            else:
+                top = np.arange(len(row))
+            top = top[np.argsort(-row[top], kind='stable')]
+            results.append([{**self.metadata[i], 'score': float(row[i])} for i in top])
+        return results
 
     # insert data into the vector database
-    def insert_index(self, in_data):
-        # if not isinstance(in_data, dict) or in_data["content"] is None or in_data["vector"] is None:
-        #     raise ValueError("input when inserting to vector database should be a dict {'content': ..., 'vector': ...}")
-        data = []
-        # Read existing data from file
-        with open(self.vdb_file, 'r') as infile:
-            data = json.load(infile)
-
-        # append new data to the end of old data
-        if isinstance(in_data, list):
-            data = data + in_data
-        else:
-            data.append(in_data)
+    def insert_index(self, in_data: Union[Dict, List[Dict]]) -> None:
+        """
+        Append one entry {'content': ..., 'vector': ...} or a list of them, existing data is not rewritten
+        """
+        entries = in_data if isinstance(in_data, list) else [in_data]
+        if len(entries) == 0:
+            return
+        matrix = np.asarray([entry['vector'] for entry in entries], dtype=np.float32)
+        if matrix.ndim != 2 or (self.dim is not None and matrix.shape[1] != self.dim):
+            raise ValueError(f'vectors inserted to the vector database should all have dimension {self.dim}')
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
 
-        # Write updated data back to file
-        with open(self.vdb_file, 'w') as outfile:
-            json.dump(data, outfile, indent=2)
+        # append vectors first, so the metadata never refers to a vector that is not written yet
+        with open(self.vectors_file, 'ab') as outfile:
+            outfile.write(matrix.tobytes())
+        with open(self.vdb_file, 'a', encoding='utf-8') as outfile:
+            for entry in entries:
+                metadata = {k: v for k, v in entry.items() if k != 'vector'}
+                outfile.write(json.dumps(metadata, ensure_ascii=False) + '\n')
+                self.metadata.append(metadata)
+        self.dim = matrix.shape[1]
+        self._matrix = None
 
     # empty the current database file
-    def empty_db(self):
-        with open(self.vdb_file, 'w') as f:
-            json.dump({}, f)
\ No newline at end of file
+    def empty_db(self) -> None:
+        open(self.vdb_file, 'w').close()
+        open(self.vectors_file, 'wb').close()
+        self.metadata = []
+        self.dim = None
+        self._matrix = None